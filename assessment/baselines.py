@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Assignment of baseline scenarios for the IPCC SR15 scenario assessment
+
+The rules to derive the name of the baseline (or reference/no-policy)
+scenario from the name of a scenario are defined in a table
+(`baseline_rules.yaml`), so that new model intercomparison projects
+can be added without changing code. The rules are evaluated for all unique
+scenario names at once, and the resulting (model, baseline) pairs are checked
+against the existing scenarios by a hash join on the meta index.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+META_IDX = ['model', 'scenario']
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'baseline_rules.yaml')
+RULE_KEYS = ['prefix', 'exclude', 'match', 'baseline', 'replace']
+
+
+def load_rules(path=RULES_FILE):
+    """Load and validate the table of baseline rules from a yaml file"""
+    with open(path, encoding='utf8') as f:
+        rules = yaml.safe_load(f) or []
+
+    for i, rule in enumerate(rules):
+        invalid = set(rule) - set(RULE_KEYS)
+        if invalid:
+            raise ValueError('unknown keys {} in baseline rule {} ({})'
+                             .format(sorted(invalid), i, path))
+        if 'prefix' not in rule:
+            raise ValueError('baseline rule {} has no `prefix` ({})'
+                             .format(i, path))
+        if ('baseline' in rule) == ('replace' in rule):
+            raise ValueError('baseline rule {} must have either `baseline` or '
+                             '`replace` ({})'.format(i, path))
+    return rules
+
+
+def _apply(rule, names):
+    """Return the baseline names for scenario names (by one rule)"""
+    if 'replace' in rule:
+        ret = pd.Series(names)
+        for old, new in rule['replace'].items():
+            ret = ret.str.replace(str(old), str(new), regex=False)
+        return ret.values
+    return np.array([rule['baseline'].format(scenario=s) for s in names],
+                    dtype=object)
+
+
+def baseline_names(scenarios, rules):
+    """Return the name of the baseline scenario for each scenario name
+    (`None` if no rule applies)"""
+    names = pd.Series(pd.unique(np.asarray(scenarios, dtype=object)),
+                      dtype=object)
+    ret = np.full(len(names), None, dtype=object)
+    todo = np.ones(len(names), dtype=bool)
+
+    for rule in rules:
+        applies = todo & names.str.startswith(rule['prefix']).values
+        if 'exclude' in rule:
+            applies &= ~names.str.contains(rule['exclude']).values
+        if 'match' in rule:
+            applies &= names.str.contains(rule['match']).values
+        if applies.any():
+            ret[applies] = _apply(rule, names[applies].values)
+            todo &= ~applies
+
+    return pd.Series(ret, index=names.values).reindex(scenarios).values
+
+
+def resolve_baselines(index, rules=None, existing=None):
+    """Return the baseline scenario of each scenario in `index`
+
+    A baseline is only assigned if that scenario exists for the same model.
+
+    Parameters
+    ----------
+    index : pandas.MultiIndex
+        scenarios (model, scenario), e.g. `IamDataFrame.meta.index`
+    rules : list of dict, optional
+        baseline rules, defaults to the rules in `baseline_rules.yaml`
+    existing : pandas.MultiIndex, optional
+        scenarios that can be assigned as baseline, defaults to `index`
+
+    Returns
+    -------
+    pandas.Series
+        name of the baseline scenario (or `None`) indexed like `index`
+    """
+    rules = load_rules() if rules is None else rules
+    existing = index if existing is None else existing
+    models = index.get_level_values('model')
+    baseline = baseline_names(index.get_level_values('scenario'), rules)
+
+    exists = pd.MultiIndex.from_arrays([models, baseline]).isin(existing)
+    return pd.Series(np.where(exists, baseline, None), index=index,
+                     name='baseline')
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the assessment steps on synthetic scenario ensembles
+
+`synthetic_ensemble()` generates an IAMC-style ensemble of configurable size
+(models, scenarios, variables, years, regions) with the structure of the SR15
+database: annual global-mean temperature and exceedance-probability curves
+(peak and decline), CO2 emissions reaching net-zero, and further variables
+at 5- or 10-year resolution. Models differ in their reporting (first year,
+time steps), and some scenarios do not report some variables or have
+no climate assessment, so that the tables have realistic `nan` patterns.
+
+`run()` times the main steps of the notebooks (the warming and cumulative
+indicators of `sr15_2.0_categories_indicators`, the annual grid
+of `indicators.annual()`, the categorization, the summary tables
+of `stats_tables.Statistics` and `utils.boxplot_by_cat`) at multiples
+of the size of the SR15 ensemble and returns a report, which is written
+as `json` and can be compared to an earlier report to spot regressions.
+
+Usage (from the `assessment` folder):
+
+    python benchmark.py [--scale 1 10 100] [--stage ...] [--repeat N]
+                        [-o benchmark.json] [--compare baseline.json]
+"""
+import argparse
+import datetime
+import json
+import platform
+import time
+
+import numpy as np
+import pandas as pd
+import pyam
+
+import categorization
+import indicators
+import stats_tables
+
+logger = pyam.logger()
+
+IAMC_IDX = ['model', 'scenario', 'region', 'variable', 'unit']
+# size of the scenario ensemble of the IPCC SR15 database (release 1.1)
+SR15_SIZE = {'models': 19, 'scenarios': 416}
+SCALES = [1, 10, 100]
+
+TEMPERATURE = 'AR5 climate diagnostics|Temperature|Global Mean|MAGICC6|MED'
+EXCEEDANCE = ('AR5 climate diagnostics|Temperature|Exceedance Probability|'
+              '{} °C|MAGICC6')
+CO2 = 'Emissions|CO2'
+THRESHOLDS = [1.5, 2.0]
+CLIMATE_YEARS = list(range(2000, 2101))
+YEARS = [2005, 2010] + list(range(2015, 2061, 5)) + list(range(2070, 2101, 10))
+CATEGORIES = ['Below 1.5C', '1.5C low overshoot', '1.5C high overshoot',
+              'Lower 2C', 'Higher 2C', 'Above 2C']
+
+
+def _index(models, scenarios, region, variable, unit):
+    return pd.MultiIndex.from_arrays(
+        [models, scenarios, np.full(len(models), region),
+         np.full(len(models), variable), np.full(len(models), unit)],
+        names=IAMC_IDX)
+
+
+def synthetic_ensemble(scale=1, variables=10, regions=1, seed=0,
+                       missing=0.05, unassessed=0.1):
+    """Generate a synthetic scenario ensemble
+
+    Parameters
+    ----------
+    scale : float, default 1
+        number of models and scenarios relative to the SR15 ensemble
+    variables : int, default 10
+        number of variables in addition to temperature, exceedance
+        probabilities and CO2 emissions
+    regions : int, default 1
+        number of regions (`World` and `R1`, `R2`, ...) of these variables
+    seed : int, default 0
+        seed of the random number generator
+    missing : float, default 0.05
+        share of scenarios not reporting a variable
+    unassessed : float, default 0.1
+        share of scenarios without climate assessment
+
+    Returns
+    -------
+    dict
+        `data`: wide timeseries tables by variable (index in IAMC format,
+        columns years), `meta`: meta table indexed by model and scenario
+        (with columns `exclude`, `category`, `subcategory` and `marker`)
+    """
+    rng = np.random.RandomState(seed)
+    n_models = max(1, int(round(SR15_SIZE['models'] * scale)))
+    n = max(n_models, int(round(SR15_SIZE['scenarios'] * scale)))
+    model_of = rng.randint(n_models, size=n)
+    models = np.array(['Model {}'.format(m) for m in range(n_models)],
+                      dtype=object)[model_of]
+    scenarios = np.array(['Scenario {}'.format(i) for i in range(n)],
+                         dtype=object)
+
+    # models report from 2005 or 2010, in 5- or 10-year time steps
+    start = rng.choice([2005, 2010], size=n_models)[model_of]
+    step = rng.choice([5, 10], size=n_models, p=[0.7, 0.3])[model_of]
+    years = np.array(YEARS)
+    reported = (years >= start[:, np.newaxis]) \
+        & ((years <= 2060) & (years % step[:, np.newaxis] == 0)
+           | (years > 2060) | (years == 2015) & (step[:, np.newaxis] == 5))
+
+    # temperature: rise to a peak and (slow) decline afterwards
+    t = np.array(CLIMATE_YEARS, dtype=float)
+    peak = rng.uniform(1.2, 3.2, n)
+    peak_year = np.clip(2040 + (peak - 1.3) * 40 + rng.normal(0, 10, n),
+                        2035, 2100)
+    decline = np.where(peak < 2, rng.uniform(0, 0.01, n), 0)
+    x = np.clip((t - 2000) / (peak_year[:, np.newaxis] - 2000), 0, 1)
+    temperature = 0.9 + (peak[:, np.newaxis] - 0.9) * np.sin(np.pi / 2 * x) \
+        - decline[:, np.newaxis] * np.maximum(t - peak_year[:, np.newaxis], 0)
+
+    # CO2 emissions: linear decline from 2020 to a floor after net-zero
+    netzero = peak_year - rng.uniform(0, 20, n) + (peak - 1.3) * 30
+    frac = np.clip((years - 2020) / (netzero[:, np.newaxis] - 2020), 0, 1.25)
+    co2 = np.where(years <= 2020, 40000 + 300 * (years - 2020),
+                   40000 * (1 - frac)) + rng.normal(0, 1000, (n, len(years)))
+
+    assessed = rng.uniform(size=n) >= unassessed
+
+    def table(values, region, variable, unit, columns, keep):
+        keep = keep & (rng.uniform(size=n) >= missing) \
+            if variable not in (TEMPERATURE, CO2) else keep
+        return pd.DataFrame(
+            values[keep], columns=pd.Index(columns, name='year'),
+            index=_index(models[keep], scenarios[keep], region, variable,
+                         unit))
+
+    data = {TEMPERATURE: table(temperature, 'World', TEMPERATURE, 'K',
+                               CLIMATE_YEARS, assessed)}
+    for thr in THRESHOLDS:
+        name = EXCEEDANCE.format(thr)
+        p = 1 / (1 + np.exp(-(temperature - thr) / 0.2))
+        data[name] = table(p, 'World', name, '-', CLIMATE_YEARS, assessed)
+    data[CO2] = table(np.where(reported, co2, np.nan), 'World', CO2,
+                      'Mt CO2/yr', YEARS, np.ones(n, dtype=bool))
+
+    region_names = ['World'] + ['R{}'.format(r) for r in range(1, regions)]
+    for v in range(variables):
+        name = 'Variable|{}'.format(v)
+        growth = rng.normal(0.01, 0.02, (n, 1))
+        values = 100 * np.exp(growth * (years - 2005)
+                              + rng.normal(0, 0.02, (n, len(years))))
+        holes = rng.uniform(size=values.shape) < 0.01
+        values = np.where(reported & ~holes, values, np.nan)
+        data[name] = pd.concat(
+            [table(values / len(region_names), r, name, 'EJ/yr', YEARS,
+                   np.ones(n, dtype=bool)) for r in region_names])
+
+    exceedance = {thr: data[EXCEEDANCE.format(thr)] for thr in THRESHOLDS}
+    meta = categorization.categorize(
+        exceedance, index=pd.MultiIndex.from_arrays(
+            [models, scenarios], names=['model', 'scenario']))
+    meta.insert(0, 'exclude', False)
+    meta['marker'] = pd.Series(np.nan, index=meta.index, dtype=object)
+    meta.iloc[rng.choice(n, size=min(n, 5), replace=False),
+              meta.columns.get_loc('marker')] = \
+        ['S1', 'S2', 'S5', 'LED', 'P1'][:min(n, 5)]
+    return {'data': data, 'meta': meta}
+
+
+def iamc_format(ensemble):
+    """Return the timeseries data of an ensemble in long IAMC format
+    (e.g., to be written as a snapshot file for `loader.load_snapshot()`)"""
+    return pd.concat(
+        [df.stack().rename('value').reset_index()
+         for df in ensemble['data'].values()], ignore_index=True)
+
+
+def _indicators(ensemble):
+    temperature, co2 = ensemble['data'][TEMPERATURE], ensemble['data'][CO2]
+    co2 = co2 / 1000
+    warming = indicators.warming_indicators(temperature, THRESHOLDS)
+    indicators.cumulative(co2, first_year=2016, last_year=2100)
+    peak_year = warming['year of peak warming'].reset_index(
+        ['region', 'variable', 'unit'], drop=True)
+    indicators.cumulative(co2, first_year=2016,
+                          last_year=indicators.year_from_meta(co2, peak_year))
+    indicators.year_of_net_zero(co2)
+    return len(temperature) + len(co2)
+
+
+def _annual(ensemble):
+    data = ensemble['data']
+    # time the interpolation, not the cache of earlier repeats
+    indicators._ANNUAL.clear()
+    n = 0
+    for name in [CO2] + [i for i in data if i.startswith('Variable|')]:
+        n += len(indicators.annual(data[name]))
+    return n
+
+
+def _categorization(ensemble):
+    exceedance = {thr: ensemble['data'][EXCEEDANCE.format(thr)]
+                  for thr in THRESHOLDS}
+    categorization.categorize(exceedance, index=ensemble['meta'].index)
+    return len(ensemble['meta'])
+
+
+def _statistics(ensemble):
+    df = ensemble['frame']
+    filters = [(('pathways', c), {'category': c}) for c in CATEGORIES]
+    stats = stats_tables.Statistics(df=df, filters=filters, rows=True)
+    n = 0
+    for name, data in ensemble['data'].items():
+        if name.startswith('Variable|'):
+            data = data.xs('World', level='region', drop_level=False)
+            stats.add(data[[2030, 2050, 2100]], header=name, row='World')
+            n += len(data)
+    stats.summarize(center='median', fullrange=True)
+    return n
+
+
+def _boxplot(ensemble):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from utils import boxplot_by_cat
+
+    years = [2030, 2050, 2100]
+    data = ensemble['data'][CO2][years] / 1000
+    data = pyam.filter_by_meta(data, ensemble['frame'], category=CATEGORIES,
+                               join_meta=True)
+    plt.figure()
+    boxplot_by_cat(data, CATEGORIES, 'category', years)
+    plt.close('all')
+    return len(data)
+
+
+STAGES = {
+    'indicators': _indicators,
+    'annual': _annual,
+    'categorization': _categorization,
+    'statistics': _statistics,
+    'boxplot_by_cat': _boxplot,
+}
+
+
+def _frame(ensemble):
+    """Return a `pyam.IamDataFrame` with the meta table of the ensemble"""
+    data = ensemble['data'][CO2][[2100]]
+    df = pyam.IamDataFrame(data.stack().rename('value').reset_index())
+    df.meta = ensemble['meta'].reindex(df.meta.index)
+    return df
+
+
+def run(scales=SCALES, stages=None, repeat=3, seed=0, **kwargs):
+    """Time the stages of the assessment on synthetic ensembles
+
+    Parameters
+    ----------
+    scales : list of float, default [1, 10, 100]
+        ensemble sizes relative to the SR15 ensemble
+    stages : list of str, optional
+        stages to run (see `STAGES`), defaults to all
+    repeat : int, default 3
+        number of runs per stage (the fastest run is reported)
+    seed : int, default 0
+        seed of the random number generator
+    kwargs
+        passed to `synthetic_ensemble()`
+
+    Returns
+    -------
+    dict
+        report with the environment and the timings by stage and scale
+    """
+    stages = list(STAGES) if stages is None else stages
+    pyam.run_control().update(categorization.run_control())
+    results = []
+    for scale in scales:
+        ensemble = synthetic_ensemble(scale, seed=seed, **kwargs)
+        ensemble['frame'] = _frame(ensemble)
+        for name in stages:
+            times = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                rows = STAGES[name](ensemble)
+                times.append(time.perf_counter() - t0)
+            logger.info('{} (x{}): {:.3f}s'.format(name, scale, min(times)))
+            results.append({'stage': name, 'scale': scale,
+                            'scenarios': len(ensemble['meta']), 'rows': rows,
+                            'seconds': min(times), 'runs': times})
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Return the stages that are slower than in a baseline report
+
+    Parameters
+    ----------
+    report, baseline : dict
+        reports as returned by `run()`
+    tolerance : float, default 0.2
+        relative increase of the run time considered a regression
+
+    Returns
+    -------
+    list of dict
+        stage, scale and run times of each regression
+    """
+    previous = {(r['stage'], r['scale']): r['seconds']
+                for r in baseline['results']}
+    regressions = []
+    for r in report['results']:
+        before = previous.get((r['stage'], r['scale']))
+        if before is not None and r['seconds'] > before * (1 + tolerance):
+            regressions.append({'stage': r['stage'], 'scale': r['scale'],
+                                'baseline': before, 'seconds': r['seconds']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=float, nargs='+', default=SCALES,
+                        help='ensemble sizes relative to the SR15 ensemble')
+    parser.add_argument('--stage', nargs='+', choices=list(STAGES),
+                        default=None, help='stages to run (default: all)')
+    parser.add_argument('--variables', type=int, default=10,
+                        help='number of additional variables')
+    parser.add_argument('--regions', type=int, default=1,
+                        help='number of regions of additional variables')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs per stage')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random number generator')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='file for the report (json)')
+    parser.add_argument('--compare', default=None,
+                        help='baseline report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown considered a regression')
+    args = parser.parse_args()
+
+    report = run(args.scale, args.stage, repeat=args.repeat, seed=args.seed,
+                 variables=args.variables, regions=args.regions)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for r in regressions:
+            logger.error('{stage} (x{scale}): {seconds:.3f}s, baseline '
+                         '{baseline:.3f}s'.format(**r))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
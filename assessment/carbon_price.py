@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Net-present value (NPV) indicators of carbon prices
+for the IPCC SR15 scenario assessment
+
+The NPV indicators in the notebook `sr15_2.0_categories_indicators`
+(average, annually compounded and continuously compounded NPV)
+are linear in the reported carbon prices. For a given set of reported years,
+the indicator is therefore a weighted sum of the prices, where the weights
+depend on the discount rate, the time steps between reported years
+and the NPV horizon.
+
+This module precomputes these weights in closed form as a matrix
+(discount rates x years) for each pattern of reported years
+and applies them as one matrix product across all scenarios,
+so a sweep over many discount rates costs about as much as a single rate.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+# below this discount rate, the closed-form weights lose precision
+SMALL_RATE = 1e-2
+
+
+def weights_average(r, dt):
+    """Weights of the earlier and later year of a time step `dt` (no discounting
+    within the time step, i.e., the cumulative sum as `pyam.cumulative()`)"""
+    r, dt = np.broadcast_arrays(np.asarray(r, dtype=float), dt)
+    return (dt + 1) / 2, (dt - 1) / 2
+
+
+def _annual_series(r, dt):
+    """Weights with annual compounding by explicit summation over years"""
+    q = 1 / (1 + r)
+    i = np.arange(1, int(np.max(dt, initial=1)) + 1)
+    i = i.reshape((1,) * r.ndim + (-1,))
+    r, dt, q = r[..., np.newaxis], dt[..., np.newaxis], q[..., np.newaxis]
+    w1 = np.where(i < dt, q ** i * (1 - i / dt), 0).sum(axis=-1)
+    w2 = np.where(i <= dt, q ** (i - dt) * (i / dt), 0).sum(axis=-1)
+    return w1, w2
+
+
+def weights_annual(r, dt):
+    """Weights of the earlier and later year of a time step `dt`
+    with annual compounding at discount rate `r` (closed-form version
+    of `compute_w1_annual()` and `compute_w2_annual()`)"""
+    r, dt = np.broadcast_arrays(np.asarray(r, dtype=float),
+                                np.asarray(dt, dtype=float))
+    q = 1 / (1 + r)
+
+    def geometric(m):  # sum of q^i for i in 1..m
+        return q * (1 - q ** m) / (1 - q)
+
+    def arithmetic_geometric(m):  # sum of i * q^i for i in 1..m
+        return q * (1 - (m + 1) * q ** m + m * q ** (m + 1)) / (1 - q) ** 2
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w1 = geometric(dt - 1) - arithmetic_geometric(dt - 1) / dt
+        w2 = q ** -dt * arithmetic_geometric(dt) / dt
+
+    # the closed form loses precision for small rates (cancellation)
+    small = np.abs(r) < SMALL_RATE
+    if small.any():
+        w1_small, w2_small = _annual_series(r[small], dt[small])
+        w1, w2 = np.array(w1), np.array(w2)
+        w1[small], w2[small] = w1_small, w2_small
+    return w1, w2
+
+
+def weights_continuous(r, dt):
+    """Weights of the earlier and later year of a time step `dt`
+    with continuous compounding at discount rate `r` (vectorized version
+    of `compute_w1_compounded()` and `compute_w2_compounded()`)"""
+    r, dt = np.broadcast_arrays(np.asarray(r, dtype=float),
+                                np.asarray(dt, dtype=float))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w1 = 1 / r - (1 - np.exp(-r * dt)) / (r * r * dt)
+        w2 = - 1 / r + (np.exp(r * dt) - 1) / (r * r * dt)
+
+    # use the Taylor series `dt * sum(x^k / (k + 2)!)` with `x = r * dt`
+    # for small rates, where the closed form loses precision (cancellation)
+    x = r * dt
+    small = np.abs(x) < SMALL_RATE * 10
+    if small.any():
+        k = np.arange(8)
+        coef = 1 / np.array([math.factorial(i + 2) for i in k])
+        x_k = x[small][:, np.newaxis] ** k
+        w1, w2 = np.array(w1), np.array(w2)
+        w1[small] = dt[small] * ((-1) ** k * coef * x_k).sum(axis=-1)
+        w2[small] = dt[small] * (coef * x_k).sum(axis=-1)
+    return w1, w2
+
+
+COMPOUNDING = {
+    'average': weights_average,
+    'annual': weights_annual,
+    'continuous': weights_continuous,
+}
+
+
+def discount_factors(years, rates, discount_year):
+    """Discount factors (rates x years) relative to `discount_year`"""
+    rates = np.asarray(rates, dtype=float)[:, np.newaxis]
+    return (1 + rates) ** -(np.asarray(years) - discount_year)[np.newaxis, :]
+
+
+def _point(years, valid, year, start=None):
+    """Coefficients (over years) of the value in `year`,
+    interpolated linearly between reported years if necessary
+
+    The logic follows `pyam.fill_series()`, where `start` is a tuple of year
+    and coefficients of a point inserted before (as in `pyam.cumulative()`).
+    """
+    exact = np.flatnonzero(valid & (years == year))
+    if len(exact):
+        return np.eye(len(years))[exact[0]]
+    if start is not None and start[0] == year:
+        return start[1]
+
+    points = [(y, np.eye(len(years))[k]) for k, y in enumerate(years)
+              if valid[k]]
+    if start is not None:
+        points.append(start)
+    prev = [(y, c) for (y, c) in points if y < year]
+    nxt = [(y, c) for (y, c) in points if y > year]
+    if not prev or not nxt:
+        return None
+    p, c_p = max(prev, key=lambda i: i[0])
+    n, c_n = min(nxt, key=lambda i: i[0])
+    return ((n - year) * c_p + (year - p) * c_n) / (n - p)
+
+
+def npv_weight_matrix(years, valid, rates, first_year, last_year,
+                      discount_year, compounding='annual'):
+    """Weight matrix (rates x years) of the NPV indicator of a price timeseries
+
+    Returns `None` if the indicator cannot be computed
+    given the reported years (`valid`).
+
+    Parameters
+    ----------
+    years : array-like
+        years of the timeseries table
+    valid : array-like of bool
+        reported (non-nan) years of the timeseries
+    rates : array-like
+        discount rates
+    first_year, last_year : int
+        first and last year of the NPV horizon (inclusive)
+    discount_year : int
+        year to which prices are discounted
+    compounding : str, default 'annual'
+        one of 'average', 'annual', 'continuous'
+    """
+    years, valid = np.asarray(years), np.asarray(valid, dtype=bool)
+    rates = np.asarray(rates, dtype=float)[:, np.newaxis]
+    weights = COMPOUNDING[compounding]
+
+    if min(years) > first_year or max(years) < last_year:
+        return None
+    c_first = _point(years, valid, first_year)
+    if c_first is None:
+        return None
+    c_last = _point(years, valid, last_year, start=(first_year, c_first))
+    if c_last is None:
+        return None
+
+    points = [(first_year, c_first)] \
+        + [(y, np.eye(len(years))[k]) for k, y in enumerate(years)
+           if valid[k] and first_year < y < last_year]
+    if last_year > first_year:
+        points.append((last_year, c_last))
+
+    w = np.tile(c_last, (len(rates), 1))
+    for (yr, c_yr), (next_yr, c_next) in zip(points[:-1], points[1:]):
+        w1, w2 = weights(rates, next_yr - yr)
+        w += w1 * c_yr + w2 * c_next
+    w /= last_year - first_year + 1
+
+    return w * discount_factors(years, rates[:, 0], discount_year)
+
+
+def npv_indicators(data, rates, first_year=2030, last_year=2100,
+                   discount_year=2020, compounding='annual'):
+    """Return the NPV indicator of carbon prices for a sweep of discount rates
+
+    The indicator is the (weighted) average of the discounted prices
+    from `first_year` until `last_year` (inclusive), discounted to
+    `discount_year`; the weights are computed once per pattern of reported
+    years and applied as a matrix product across all scenarios.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table of (undiscounted) prices
+        (rows: scenarios, columns: years)
+    rates : float or array-like
+        discount rate(s)
+    first_year, last_year : int, default 2030, 2100
+        first and last year of the NPV horizon (inclusive)
+    discount_year : int, default 2020
+        year to which prices are discounted
+    compounding : str, default 'annual'
+        one of 'average', 'annual', 'continuous'
+
+    Returns
+    -------
+    pandas.DataFrame
+        table of shape (scenarios, rates)
+    """
+    rates = np.atleast_1d(np.asarray(rates, dtype=float))
+    years = np.asarray(data.columns, dtype=int)
+    values = np.asarray(data.values, dtype=float)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0)
+
+    ret = np.full((len(values), len(rates)), np.nan)
+    patterns, inverse = np.unique(valid, axis=0, return_inverse=True)
+    for i, pattern in enumerate(patterns):
+        w = npv_weight_matrix(years, pattern, rates, first_year, last_year,
+                              discount_year, compounding)
+        if w is not None:
+            rows = np.flatnonzero(inverse.ravel() == i)
+            ret[rows] = filled[rows] @ w.T
+
+    return pd.DataFrame(ret, index=data.index,
+                        columns=pd.Index(rates, name='discount rate'))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Categorization of scenarios by warming outcome
+for the IPCC SR15 scenario assessment
+
+The (sub)categories are defined declaratively in the table `SUBCATEGORIES`,
+using the notation of the category specification in Chapter 2:
+`P1.5°C` is the probability of exceeding 1.5°C in at least one year
+(i.e., the peak of the exceedance probability over the century)
+and `P1.5°C(2100)` is the probability of exceedance in the year 2100.
+Each criterion is a tuple `(lo, up)` for `lo < P ≤ up` (`None` for no bound).
+
+The table is compiled into one vectorized classifier: the indicators are
+computed once from the exceedance-probability timeseries, and each scenario
+is assigned to the first subcategory in the table whose criteria it satisfies.
+This reproduces the sequential assignment by `pyam.categorize()`
+(where each step only considers scenarios that are not yet categorized).
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+META_IDX = ['model', 'scenario']
+UNCATEGORIZED = 'uncategorized'
+
+SUBCATEGORIES = pd.DataFrame([
+    ('Below 1.5C', 'Below 1.5C (I)',
+     {'P1.5°C': (None, 0.34)}, 'xkcd:baby blue'),
+    ('Below 1.5C', 'Below 1.5C (II)',
+     {'P1.5°C': (0.34, 0.50)}, 'xkcd:baby blue'),
+    ('1.5C low overshoot', 'Lower 1.5C low overshoot',
+     {'P1.5°C': (0.50, 0.67), 'P1.5°C(2100)': (None, 0.34)}, 'xkcd:bluish'),
+    ('1.5C low overshoot', 'Higher 1.5C low overshoot',
+     {'P1.5°C': (0.50, 0.67), 'P1.5°C(2100)': (0.34, 0.50)}, 'xkcd:bluish'),
+    ('1.5C high overshoot', 'Lower 1.5C high overshoot',
+     {'P1.5°C': (0.66, None), 'P1.5°C(2100)': (None, 0.34)},
+     'xkcd:darkish blue'),
+    ('1.5C high overshoot', 'Higher 1.5C high overshoot',
+     {'P1.5°C': (0.66, None), 'P1.5°C(2100)': (0.34, 0.50)},
+     'xkcd:darkish blue'),
+    ('Lower 2C', 'Lower 2C',
+     {'P2.0°C': (None, 0.34)}, 'xkcd:orange'),
+    ('Higher 2C', 'Higher 2C',
+     {'P2.0°C': (0.34, 0.50)}, 'xkcd:red'),
+    ('Above 2C', 'Above 2C',
+     {'P2.0°C': (0.50, 1.0)}, 'darkgrey'),
+], columns=['category', 'subcategory', 'criteria', 'color'])
+
+_INDICATOR = re.compile(
+    r'^P(?P<threshold>\d+(\.\d+)?)°C(\((?P<year>\d{4})\))?$')
+
+
+def _parse(indicator):
+    """Return the threshold and year (or `None` for the peak) of an indicator"""
+    match = _INDICATOR.match(indicator)
+    if match is None:
+        raise ValueError('invalid categorization indicator `{}`'
+                         .format(indicator))
+    year = match.group('year')
+    return float(match.group('threshold')), int(year) if year else None
+
+
+def _scenario_index(data):
+    """Drop all index levels except model and scenario"""
+    drop = [i for i in data.index.names if i not in META_IDX]
+    return data.reset_index(drop, drop=True) if drop else data
+
+
+def _indicator(data, year, index):
+    """Peak (`year=None`) or value in `year` of the exceedance probability,
+    aligned to `index` (nan if not reported)"""
+    data = _scenario_index(data).reindex(index)
+    values = np.asarray(data.values, dtype=float)
+    if year is None:
+        valid = ~np.isnan(values)
+        ret = np.where(valid, values, -np.inf).max(axis=1, initial=-np.inf)
+        return np.where(valid.any(axis=1), ret, np.nan)
+    if year not in data.columns:
+        return np.full(len(index), np.nan)
+    return np.asarray(data[year].values, dtype=float)
+
+
+def categorize(exceedance, index=None, rules=None, default=UNCATEGORIZED):
+    """Assign category and subcategory to all scenarios in one pass
+
+    Parameters
+    ----------
+    exceedance : dict
+        wide timeseries tables of the exceedance probability by warming
+        threshold, e.g. `{1.5: df_15, 2.0: df_20}` (rows: scenarios,
+        index including the levels `model` and `scenario`)
+    index : pandas.MultiIndex, optional
+        scenarios (model, scenario) to be categorized,
+        defaults to all scenarios in `exceedance`
+    rules : pandas.DataFrame, optional
+        table of (sub)categories with criteria in order of precedence,
+        defaults to `SUBCATEGORIES`
+    default : str, default 'uncategorized'
+        value for scenarios that satisfy none of the criteria
+
+    Returns
+    -------
+    pandas.DataFrame
+        columns `category` and `subcategory` indexed by model and scenario
+    """
+    rules = SUBCATEGORIES if rules is None else rules
+    if index is None:
+        index = pd.MultiIndex.from_tuples([], names=META_IDX)
+        for data in exceedance.values():
+            index = index.union(_scenario_index(data).index)
+
+    indicators = {}
+    for criteria in rules['criteria']:
+        for name in criteria:
+            if name not in indicators:
+                threshold, year = _parse(name)
+                indicators[name] = _indicator(exceedance[threshold], year,
+                                              index)
+
+    # comparisons with nan (not reported) are `False`, so the criterion fails
+    conditions = []
+    with np.errstate(invalid='ignore'):
+        for criteria in rules['criteria']:
+            cond = np.ones(len(index), dtype=bool)
+            for name, (lo, up) in criteria.items():
+                value = indicators[name]
+                cond &= ~np.isnan(value)
+                if lo is not None:
+                    cond &= value > lo
+                if up is not None:
+                    cond &= value <= up
+            conditions.append(cond)
+
+    return pd.DataFrame({
+        'category': np.select(conditions, rules['category'].values, default),
+        'subcategory': np.select(conditions, rules['subcategory'].values,
+                                 default),
+    }, index=index)
+
+
+def run_control(rules=None):
+    """Return the colors of (sub)categories for `pyam.run_control().update()`
+
+    The color of a category is the color of its first subcategory.
+    """
+    rules = SUBCATEGORIES if rules is None else rules
+    first = rules.drop_duplicates('category')
+    return {'color': {
+        'subcategory': dict(zip(rules['subcategory'], rules['color'])),
+        'category': dict(zip(first['category'], first['color'])),
+    }}
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export of the tables of the IPCC SR15 scenario assessment
+
+The meta table (categorization and indicators) and the data tables behind
+the figures are written by `write_tables()` in a binary columnar format
+as the primary artifact, one file per sheet in a folder next to the path
+of the workbook, e.g.,
+
+    output/fig2.4_data_table.xlsx  ->  output/fig2.4_data_table/
+                                           0.parquet
+                                           1.parquet
+                                           ...
+                                           tables.json
+
+The file `tables.json` lists the sheets (in order) with their file,
+the format and the original column labels (e.g., years as integers). Reading a table back
+(`read_table()`) is much faster than parsing the workbook, and
+`loader.load_meta()` and `incremental.read_meta()` use the tables
+whenever they exist.
+
+Formats are pluggable: a format is a pair of functions to write
+a `pyarrow.Table` to a file and read it back (see `register()`);
+Parquet (default) and Feather (Arrow IPC) are available.
+
+The `xlsx` workbooks are a presentation artifact generated on demand:
+`write_excel()` (or `python export.py`, or `python pipeline.py --excel`)
+writes the workbooks of all tables that are newer than their workbook,
+in parallel processes. A workbook can also be written immediately
+by `write_tables(..., excel=True)`.
+"""
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyam
+
+logger = pyam.logger()
+
+try:
+    import pyarrow
+    from pyarrow import feather, parquet
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = 'tables.json'
+DEFAULT_FORMAT = 'parquet'
+
+# writer and reader of each format (see `register()`)
+FORMATS = {}
+
+
+def register(name, write, read):
+    """Register a format for the primary tables
+
+    Parameters
+    ----------
+    name : str
+        name of the format, also used as file extension
+    write : function
+        `write(table, path)`, writing a `pyarrow.Table` to a file
+    read : function
+        `read(path)`, returning a `pyarrow.Table`
+    """
+    FORMATS[name] = (write, read)
+
+
+if HAS_ARROW:
+    register('parquet', parquet.write_table, parquet.read_table)
+    register('feather', feather.write_feather,
+             lambda path: feather.read_table(path, memory_map=True))
+
+
+def table_dir(path):
+    """Return the folder of the primary tables for a workbook path"""
+    return os.path.splitext(path)[0]
+
+
+def _read_manifest(path):
+    f = os.path.join(table_dir(path), MANIFEST)
+    if not os.path.isfile(f):
+        return None
+    with open(f) as stream:
+        return json.load(stream)
+
+
+def exists(path):
+    """Whether the primary tables of a workbook path exist"""
+    return HAS_ARROW and _read_manifest(path) is not None
+
+
+def files(path):
+    """Return the files of the primary tables of a workbook path
+    (empty if there are none)"""
+    manifest = _read_manifest(path)
+    if manifest is None:
+        return []
+    folder = table_dir(path)
+    return [os.path.join(folder, MANIFEST)] + [
+        os.path.join(folder, s['file']) for s in manifest['sheets']]
+
+
+def sheets(path):
+    """Return the names of the sheets of the primary tables of a workbook"""
+    return [s['name'] for s in _read_manifest(path)['sheets']]
+
+
+def _label(value):
+    """Column label as json value (tuples of a `pandas.MultiIndex` as list)"""
+    if isinstance(value, tuple):
+        return [_label(i) for i in value]
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _to_arrow(data):
+    """Convert a table to `pyarrow.Table` (column labels as strings)"""
+    data = data.copy(deep=False)
+    data.columns = [str(c) for c in data.columns]
+    return pyarrow.Table.from_pandas(data)
+
+
+def _from_arrow(table, sheet):
+    data = table.to_pandas()
+    columns = sheet['columns']
+    if columns and isinstance(columns[0], list):
+        data.columns = pd.MultiIndex.from_tuples(
+            [tuple(c) for c in columns], names=sheet['column_names'])
+    else:
+        data.columns = pd.Index(columns, name=sheet['column_names'][0])
+    return data
+
+
+def _table_dict(tables):
+    if isinstance(tables, (pd.DataFrame, pd.Series)):
+        tables = {'data': tables}
+    return {name: data.to_frame() if isinstance(data, pd.Series) else data
+            for name, data in tables.items()}
+
+
+def write_tables(path, tables, index=True, fmt=DEFAULT_FORMAT, excel=False):
+    """Write tables to the primary format (and optionally as workbook)
+
+    Parameters
+    ----------
+    path : str
+        path of the workbook (`xlsx`), e.g. `output/fig2.6_data_table.xlsx`
+    tables : pandas.DataFrame or dict of pandas.DataFrame
+        one table or tables by sheet name
+    index : bool or dict, default True
+        whether the index is written to the sheets of the workbook
+        (for all sheets or by sheet name); the index is always kept
+        in the primary tables
+    fmt : str, default 'parquet'
+        format of the primary tables (see `register()`)
+    excel : bool, default False
+        write the workbook immediately instead of on demand
+    """
+    tables = _table_dict(tables)
+    if not HAS_ARROW:
+        logger.warning('`pyarrow` is not installed, writing `{}` directly'
+                       .format(path))
+        remove(path)
+        return _write_workbook(path, tables, index)
+    write, _ = FORMATS[fmt]
+
+    folder = table_dir(path)
+    tmp = '{}.{}.tmp'.format(folder, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    manifest = {'workbook': os.path.basename(path), 'format': fmt,
+                'sheets': []}
+    try:
+        for i, (name, data) in enumerate(tables.items()):
+            sheet = {
+                'name': name,
+                'file': '{}.{}'.format(i, fmt),
+                'index': index.get(name, True) if isinstance(index, dict)
+                else index,
+                'columns': [_label(c) for c in data.columns],
+                'column_names': list(data.columns.names),
+            }
+            write(_to_arrow(data), os.path.join(tmp, sheet['file']))
+            manifest['sheets'].append(sheet)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as e:
+        # columns of mixed types cannot be stored as Arrow table
+        shutil.rmtree(tmp)
+        logger.info('writing `{}` as workbook only: {}'.format(path, e))
+        remove(path)
+        return _write_workbook(path, tables, index)
+
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    # replace the previous tables and remove the (now outdated) workbook
+    remove(path)
+    os.rename(tmp, folder)
+    if excel:
+        write_excel([path])
+
+
+def remove(path):
+    """Remove the primary tables and the workbook of a path"""
+    shutil.rmtree(table_dir(path), ignore_errors=True)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def read_table(path, sheet=None):
+    """Read one table of the primary tables of a workbook path
+
+    Parameters
+    ----------
+    path : str
+        path of the workbook (`xlsx`)
+    sheet : str, optional
+        name of the sheet, defaults to the first sheet
+    """
+    manifest = _read_manifest(path)
+    if manifest is None:
+        raise ValueError("no tables for '{}' found!".format(path))
+    _sheets = {s['name']: s for s in manifest['sheets']}
+    _sheet = manifest['sheets'][0] if sheet is None else _sheets[sheet]
+    _, read = FORMATS[manifest['format']]
+    table = read(os.path.join(table_dir(path), _sheet['file']))
+    return _from_arrow(table, _sheet)
+
+
+def _write_workbook(path, tables, index=True):
+    """Write tables as sheets of an `xlsx` workbook"""
+    writer = pd.ExcelWriter(path)
+    for name, data in tables.items():
+        _index = index.get(name, True) if isinstance(index, dict) else index
+        if isinstance(data.columns, pd.MultiIndex):
+            # `write_sheet()` does not support multi-level column headers
+            data.to_excel(writer, sheet_name=name, index=_index)
+        else:
+            pyam.utils.write_sheet(writer, name, data, index=_index)
+    writer.save()
+
+
+def _write_excel(path):
+    """Write the workbook of the primary tables of a path"""
+    manifest = _read_manifest(path)
+    tables = {s['name']: read_table(path, s['name'])
+              for s in manifest['sheets']}
+    index = {s['name']: s['index'] for s in manifest['sheets']}
+    tmp = '{}.{}.tmp.xlsx'.format(os.path.splitext(path)[0], os.getpid())
+    _write_workbook(tmp, tables, index)
+    os.replace(tmp, path)
+    return path
+
+
+def outdated(folders=None):
+    """Return the workbook paths whose primary tables are newer than
+    the workbook (or whose workbook does not exist)
+
+    Parameters
+    ----------
+    folders : list of str, optional
+        folders to search, defaults to this folder and `output`
+    """
+    folders = folders or [HERE, os.path.join(HERE, 'output')]
+    paths = []
+    for folder in folders:
+        for f in sorted(glob.glob(os.path.join(folder, '*', MANIFEST))):
+            with open(f) as stream:
+                workbook = json.load(stream)['workbook']
+            path = os.path.join(folder, workbook)
+            if not os.path.exists(path) \
+                    or os.path.getmtime(path) < os.path.getmtime(f):
+                paths.append(path)
+    return paths
+
+
+def write_excel(paths=None, jobs=None):
+    """Write the workbooks of primary tables, in parallel processes
+
+    Parameters
+    ----------
+    paths : list of str, optional
+        workbook paths, defaults to all outdated workbooks (see `outdated()`)
+    jobs : int, optional
+        number of worker processes, defaults to the number of cores
+
+    Returns
+    -------
+    list of str
+        paths of the workbooks written
+    """
+    paths = outdated() if paths is None else paths
+    if len(paths) < 2 or jobs == 1:
+        return [_write_excel(p) for p in paths]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_write_excel, paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write the `xlsx` workbooks of all outdated tables')
+    parser.add_argument('folders', nargs='*',
+                        help='folders to search (default: `.` and `output`)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes')
+    args = parser.parse_args()
+    for path in write_excel(outdated(args.folders or None), jobs=args.jobs):
+        logger.info('wrote `{}`'.format(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless rendering of the figures of the IPCC SR15 scenario assessment
+
+A figure is specified by the output file, the plotting function (e.g.,
+`utils.boxplot_by_cat` or `pyam.plotting.stack_plot`), the data slice
+passed to that function and its keyword arguments. All figures of a notebook
+are rendered in parallel by worker processes using the `Agg` backend.
+
+Each output is identified by a hash of the data slice, the arguments,
+the source of the plotting function, the style file (`style_sr15.mplstyle`)
+and the run control (colors, markers). A figure is skipped if its output
+exists and the hash is unchanged since it was last rendered.
+The hashes are kept in `.cache/figures.json`. Notebooks executed in parallel
+(see `pipeline.py`) share this file: after rendering, each `render()` call
+re-reads it and merges its own entries while holding a lock
+(`.cache/figures.lock`), so that no entries of other notebooks are lost.
+"""
+import concurrent.futures
+import contextlib
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+import pandas as pd
+import pyam
+
+from loader import file_hash
+from profiling import stage
+
+logger = pyam.logger()
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(HERE, '.cache', 'figures.json')
+LOCK_FILE = os.path.join(HERE, '.cache', 'figures.lock')
+STYLE_FILE = os.path.join(HERE, 'style_sr15.mplstyle')
+
+
+def _update(h, obj):
+    """Update a hash object by data (`DataFrame`, `IamDataFrame`) or values"""
+    if isinstance(obj, pyam.IamDataFrame):
+        _update(h, obj.data)
+        _update(h, obj.meta)
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        obj = obj.to_frame() if isinstance(obj, pd.Series) else obj
+        h.update(repr((obj.shape, list(obj.index.names),
+                       [str(c) for c in obj.columns],
+                       [str(d) for d in obj.dtypes])).encode('utf8'))
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    else:
+        h.update(pickle.dumps(obj, protocol=4))
+
+
+def _source_hash(func):
+    """Identify a plotting function by its name and the hash of its module"""
+    name = '{}.{}'.format(func.__module__, func.__qualname__)
+    try:
+        return name, file_hash(inspect.getsourcefile(inspect.unwrap(func)))
+    except (TypeError, OSError):
+        return name, None
+
+
+class Figure(object):
+    """Specification of a figure
+
+    Parameters
+    ----------
+    path : str
+        output file (the format is derived from the extension)
+    plot : function
+        module-level plotting function called as `plot(data, **kwargs)`;
+        if it takes an argument `ax`, the axes of a new figure are passed
+    data : pandas.DataFrame or pyam.IamDataFrame
+        data slice to be plotted
+    figsize : tuple, optional
+        width and height of the figure (inches)
+    kwargs
+        passed to `plot`
+    """
+
+    def __init__(self, path, plot, data, figsize=None, **kwargs):
+        self.path = os.path.abspath(path)
+        self.plot = plot
+        self.data = data
+        self.figsize = figsize
+        self.kwargs = kwargs
+
+    def key(self, style, rc):
+        """Hash of the data slice, arguments, plotting function and style"""
+        h = hashlib.sha256()
+        _update(h, _source_hash(self.plot))
+        _update(h, self.data)
+        _update(h, (self.figsize, sorted(self.kwargs.items())))
+        _update(h, file_hash(style))
+        _update(h, rc)
+        return h.hexdigest()
+
+    @stage('Figure.draw')
+    def draw(self):
+        """Draw the figure on the current backend and save it"""
+        import matplotlib.pyplot as plt
+
+        fig = plt.figure(figsize=self.figsize)
+        kwargs = dict(self.kwargs)
+        if 'ax' in inspect.signature(self.plot).parameters \
+                and 'ax' not in kwargs:
+            kwargs['ax'] = fig.gca()
+        self.plot(self.data, **kwargs)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        plt.gcf().savefig(self.path)
+        plt.close('all')
+
+
+def _read_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def _write_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(STATE_FILE, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, STATE_FILE)
+
+
+@contextlib.contextmanager
+def _lock():
+    """Hold an exclusive lock on the state file (across processes)"""
+    os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+    with open(LOCK_FILE, 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _merge_state(update):
+    """Merge the hashes of rendered figures into the state file
+    (`None` removes the entry of a failed figure)"""
+    with _lock():
+        state = _read_state()
+        for path, key in update.items():
+            if key is None:
+                state.pop(path, None)
+            else:
+                state[path] = key
+        _write_state(state)
+
+
+def _init_worker(style, rc):
+    """Set up the headless backend, style and run control of a worker"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.style.use(style)
+    pyam.run_control().update(rc)
+
+
+def render(figures, jobs=None, force=False, style=STYLE_FILE):
+    """Render figures in parallel, skipping those that are unchanged
+
+    Parameters
+    ----------
+    figures : list of Figure
+        figure specifications
+    jobs : int, optional
+        number of worker processes, defaults to the number of cores
+    force : bool, default False
+        render all figures even if unchanged
+    style : str, default `style_sr15.mplstyle`
+        matplotlib style file
+
+    Returns
+    -------
+    dict
+        status of each output: 'done' or 'skipped'
+
+    Raises
+    ------
+    RuntimeError
+        if any figure failed (after all other figures are rendered);
+        the outputs of failed figures are removed so that no figure
+        of an earlier run is shown or counted as up to date
+    """
+    rc = dict(pyam.run_control())
+    state = _read_state()
+    status, todo, update = {}, {}, {}
+
+    for f in figures:
+        key = f.key(style, rc)
+        if not force and state.get(f.path) == key \
+                and os.path.exists(f.path):
+            status[f.path] = 'skipped'
+            logger.info('`{}` is up to date'.format(f.path))
+        else:
+            todo[f.path] = (f, key)
+
+    if todo:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(style, rc))
+        with pool:
+            futures = {pool.submit(f.draw): path
+                       for path, (f, _) in todo.items()}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    status[path] = 'failed'
+                    update[path] = None
+                    logger.error('`{}` failed: {}'.format(path, e))
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    status[path] = 'done'
+                    update[path] = todo[path][1]
+        _merge_state(update)
+
+    failed = [f.path for f in figures if status[f.path] == 'failed']
+    if failed:
+        raise RuntimeError('rendering failed for {} figure(s): {}'
+                           .format(len(failed), ', '.join(failed)))
+
+    return {f.path: status[f.path] for f in figures}
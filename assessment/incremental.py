@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental rebuild of the metadata workbook `sr15_metadata_indicators.xlsx`
+
+Almost all categories and indicators assigned in the notebook
+`sr15_2.0_categories_indicators` depend only on the timeseries data
+of the respective scenario. When only some scenarios of the snapshot change
+(e.g., after a resubmission by a modelling team), it is therefore sufficient
+to recompute the metadata for these scenarios and merge the results into
+the existing meta table.
+
+The exceptions depend on the other scenarios in the snapshot and are always
+computed against the full snapshot:
+
+ - the column `baseline`, which is only assigned if the baseline scenario
+   exists for the same model (see `baselines.resolve_baselines()`),
+ - the table of references (`def_references`), which lists the references
+   matching any scenario (see `references.assign_references()`).
+
+Each (model, scenario) block of timeseries data is identified by a fingerprint,
+an order-independent combination of row hashes. The fingerprints of the last
+export are stored in a csv file next to the workbook, together with a hash
+of everything else the metadata depend on (see `inputs_hash()`): the code of
+the notebook, the local modules it imports (e.g., `indicators.py`) and its
+input files other than the snapshot (e.g., `baseline_rules.yaml`).
+If this hash changed, all scenarios are processed. All scenarios are also
+processed if the environment variable `SR15_REBUILD_ALL` is set
+(see `python pipeline.py --force`).
+If neither the inputs nor any scenario changed, the notebook raises `UpToDate`
+to stop before any recomputation, keeping the existing export
+(`pipeline.py` treats this as up to date).
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyam
+
+import export
+from loader import file_hash
+
+logger = pyam.logger()
+
+META_IDX = ['model', 'scenario']
+DATA_COLS = ['region', 'variable', 'unit', 'year', 'value']
+REBUILD_ENV = 'SR15_REBUILD_ALL'
+
+
+class UpToDate(Exception):
+    """Raised to stop the notebook if neither the inputs nor any scenario
+    changed since the last export"""
+
+    def _render_traceback_(self):
+        # shown by Jupyter instead of the full traceback
+        return ['{}: {}'.format(type(self).__name__, self)]
+
+
+def fingerprint_path(path):
+    """Return the path of the fingerprint file for a metadata workbook"""
+    return '{}_fingerprints.csv'.format(os.path.splitext(path)[0])
+
+
+def rebuild_requested():
+    """Whether processing all scenarios was requested
+    (by the environment variable `SR15_REBUILD_ALL`)"""
+    return bool(os.environ.get(REBUILD_ENV))
+
+
+def inputs_path(path):
+    """Return the path of the file with the hash of the inputs
+    for a metadata workbook"""
+    return '{}_inputs.txt'.format(os.path.splitext(path)[0])
+
+
+def inputs_hash(notebook, exclude=None):
+    """Return a hash of the code and non-data inputs of a notebook
+
+    The hash covers the code cells of the notebook, the local modules
+    imported by it (recursively) and the files it reads (as determined
+    by `pipeline.Notebook`), except the files in `exclude`.
+
+    Parameters
+    ----------
+    notebook : str
+        path to the notebook
+    exclude : list of str, optional
+        input files not included in the hash (e.g., the snapshot, whose
+        changes are tracked by the fingerprints of each scenario)
+    """
+    import pipeline  # `pipeline` imports this module
+
+    nb = pipeline.Notebook(notebook)
+    exclude = [os.path.normpath(os.path.abspath(f)) for f in exclude or []]
+    h = hashlib.sha256(pipeline._code(nb.path).encode('utf8'))
+    for f in nb.modules + [i for i in nb.inputs if i not in exclude]:
+        h.update(os.path.basename(f).encode('utf8'))
+        h.update((file_hash(f) if os.path.isfile(f) else 'missing')
+                 .encode('utf8'))
+    return h.hexdigest()
+
+
+def fingerprints(data):
+    """Return the fingerprint of the timeseries data of each scenario
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        timeseries data in long IAMC format (`pyam.IamDataFrame.data`)
+
+    Returns
+    -------
+    pandas.Series
+        hex digests indexed by model and scenario
+    """
+    rows = pd.util.hash_pandas_object(data[DATA_COLS], index=False).values
+    codes, scenarios = pd.factorize(
+        pd.MultiIndex.from_arrays([data[i] for i in META_IDX]))
+    # summation (modulo 2^64) is independent of the order of the rows
+    h = np.zeros(len(scenarios), dtype=np.uint64)
+    np.add.at(h, codes, rows)
+    return pd.Series(['{:016x}'.format(i) for i in h], name='fingerprint',
+                     index=pd.MultiIndex.from_tuples(scenarios,
+                                                     names=META_IDX))
+
+
+def _exported(path):
+    return export.exists(path) or os.path.exists(path)
+
+
+def read_fingerprints(path):
+    """Read the fingerprints of the last export of a metadata workbook
+    (empty if there is no previous export)"""
+    f = fingerprint_path(path)
+    if not (_exported(path) and os.path.exists(f)):
+        return pd.Series(name='fingerprint', dtype=object,
+                         index=pd.MultiIndex.from_tuples([], names=META_IDX))
+    return pd.read_csv(f, index_col=META_IDX, dtype=str)['fingerprint']
+
+
+def read_inputs_hash(path):
+    """Read the hash of the inputs of the last export of a metadata workbook
+    (`None` if there is no previous export)"""
+    f = inputs_path(path)
+    if not (_exported(path) and os.path.exists(f)):
+        return None
+    with open(f) as stream:
+        return stream.read().strip()
+
+
+def write_fingerprints(fingerprints, path, inputs=None):
+    """Write the fingerprints (and the hash of the inputs, see `inputs_hash()`)
+    next to a metadata workbook"""
+    fingerprints.to_frame().to_csv(fingerprint_path(path))
+    if inputs is not None:
+        with open(inputs_path(path), 'w') as f:
+            f.write(inputs + '\n')
+
+
+def changed_scenarios(current, previous):
+    """Return the index of scenarios that are new or whose data changed"""
+    previous = previous.reindex(current.index)
+    return current.index[current.values != previous.values]
+
+
+def subset(df, index):
+    """Return a `pyam.IamDataFrame` with the scenarios in `index` only"""
+    data = df.data
+    keep = pd.MultiIndex.from_arrays([data[i] for i in META_IDX]).isin(index)
+    return pyam.IamDataFrame(data[keep])
+
+
+def read_meta(path):
+    """Read the meta table of a metadata workbook
+    (from the exported tables if they exist)"""
+    if export.exists(path):
+        return export.read_table(path, 'meta')
+    return pd.read_excel(path, sheet_name='meta', index_col=[0, 1])\
+        .rename_axis(META_IDX)
+
+
+def merge_meta(previous, update, index):
+    """Merge updated metadata into the meta table of the last export
+
+    Parameters
+    ----------
+    previous : pandas.DataFrame
+        meta table of the last export
+    update : pandas.DataFrame
+        meta table of the recomputed scenarios
+    index : pandas.MultiIndex
+        all scenarios in the current snapshot (others are dropped)
+    """
+    columns = list(update.columns) \
+        + [i for i in previous.columns if i not in update.columns]
+    previous = previous.loc[previous.index.isin(index)
+                            & ~previous.index.isin(update.index)]
+    meta = pd.concat([previous, update], sort=False)
+    missing = index.difference(meta.index)
+    if len(missing):
+        logger.warning('no metadata for {} scenarios'.format(len(missing)))
+    return meta.reindex(index)[columns]
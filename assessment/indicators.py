@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized computation of the metadata indicators
+of the IPCC SR15 scenario assessment
+
+All functions take a wide timeseries table (as returned by
+`pyam.IamDataFrame.timeseries()`, one row per scenario and one column per year)
+and compute the indicator for all rows at once on the underlying numpy array.
+The results are identical to the row-wise functions originally used in the
+notebook `sr15_2.0_categories_indicators` (and `pyam.cumulative()`),
+including interpolation between reported years and rounding of crossing years
+(see the reference implementations in `test_indicators.py`).
+
+The ensemble mixes 5- and 10-year timesteps. All values between reported
+years are interpolated linearly (as `pyam.fill_series()`) by one kernel
+that brackets the target years of all rows at once (`_bracket()`), and
+crossing years (exceedance, return and net-zero years) are computed
+in closed form from the reported years bracketing the crossing,
+so that the published indicators do not need an annual grid.
+
+Analyses that need values in every year (e.g., annual rates of change or sums
+over arbitrary periods) can opt in to `annual()`, which converts a table
+to an annual grid in one vectorized step using the same kernel,
+processing rows in chunks to bound memory and caching the grid
+for the lifetime of the table.
+"""
+import weakref
+
+import numpy as np
+import pandas as pd
+
+META_IDX = ['model', 'scenario']
+EXCEEDANCE_COLS = ['exceedance year', 'return year', 'overshoot years']
+# maximum number of array elements of intermediate masks (per chunk of rows)
+CHUNKSIZE = 2 ** 24
+
+# annual grids computed in this process, by table and range of years
+_ANNUAL = {}
+
+
+def _matrix(data):
+    """Return the values and years of a wide timeseries table as arrays"""
+    return (np.asarray(data.values, dtype=float),
+            np.asarray(data.columns, dtype=int))
+
+
+def _as_vector(x, n):
+    """Broadcast a scalar or array-like to a float vector of length `n`"""
+    return np.broadcast_to(np.asarray(x, dtype=float), (n,))
+
+
+def _first(mask):
+    """Index of the first `True` along the last axis and whether there is any"""
+    k = mask.argmax(axis=-1)
+    return k, np.take_along_axis(mask, k[..., np.newaxis], axis=-1)[..., 0]
+
+
+def _last(mask):
+    """Index of the last `True` along the last axis and whether there is any"""
+    k = mask.shape[-1] - 1 - mask[..., ::-1].argmax(axis=-1)
+    return k, np.take_along_axis(mask, k[..., np.newaxis], axis=-1)[..., 0]
+
+
+def _previous(mask):
+    """Column index of the last `True` strictly before each column (or -1)"""
+    idx = np.where(mask, np.arange(mask.shape[1]), -1)
+    idx = np.maximum.accumulate(idx, axis=1)
+    prev = np.full(idx.shape, -1)
+    prev[:, 1:] = idx[:, :-1]
+    return prev
+
+
+def _crossing_year(prev_yr, prev_val, yr, val, threshold, upwards):
+    """Year of crossing `threshold` by linear interpolation between years
+
+    The first year at or after the crossing point is returned
+    (`int()` rounds down, so one year is added to the truncated distance).
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if upwards:
+            x = (val - prev_val) / (yr - prev_yr)
+            dist = (threshold - prev_val) / x
+        else:
+            x = (prev_val - val) / (yr - prev_yr)
+            dist = (prev_val - threshold) / x
+        return prev_yr + np.trunc(dist) + 1
+
+
+def peak_warming(data):
+    """Return the peak value and the (first) year of the peak per timeseries
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    """
+    values, years = _matrix(data)
+    valid = ~np.isnan(values).all(axis=1)
+    peak = np.full(len(values), np.nan)
+    peak[valid] = np.nanmax(values[valid], axis=1)
+    k, _ = _first(values == peak[:, np.newaxis])
+    year = np.where(valid, years[k], np.nan)
+    return pd.DataFrame({'value': peak, 'year': year}, index=data.index)
+
+
+def _exceedance(values, years, thresholds):
+    """Exceedance and return years for a vector of thresholds
+
+    Returns two arrays of shape (scenarios, thresholds); the threshold axis
+    is evaluated in one sweep, rows are processed in chunks to bound memory.
+    """
+    n, k = len(values), len(thresholds)
+    exceedance_yr = np.full((n, k), np.nan)
+    return_yr = np.full((n, k), np.nan)
+    t = thresholds[np.newaxis, :, np.newaxis]
+    cols = np.arange(len(years))
+    chunk = max(1, CHUNKSIZE // max(1, len(years) * k))
+
+    for start in range(0, n, chunk):
+        v = values[start:start + chunk]
+        rows = np.arange(len(v))[:, np.newaxis]
+        valid = ~np.isnan(v)
+        prev = _previous(valid)
+        v3, valid3 = v[:, np.newaxis, :], valid[:, np.newaxis, :]
+
+        with np.errstate(invalid='ignore'):
+            above = valid3 & (v3 > t)
+        i, exceeds = _first(above)
+        p = prev[rows, i]
+        exceeds &= p >= 0
+        exceedance_yr[start:start + chunk] = np.where(
+            exceeds,
+            _crossing_year(years[p], v[rows, p], years[i], v[rows, i],
+                           thresholds, upwards=True),
+            np.nan)
+
+        with np.errstate(invalid='ignore'):
+            below = valid3 & (v3 < t) & exceeds[:, :, np.newaxis] \
+                & (cols > i[:, :, np.newaxis])
+        i, returns = _first(below)
+        p = prev[rows, i]
+        return_yr[start:start + chunk] = np.where(
+            returns,
+            _crossing_year(years[p], v[rows, p], years[i], v[rows, i],
+                           thresholds, upwards=False),
+            np.nan)
+
+    return exceedance_yr, return_yr
+
+
+def exceedance_grid(data, thresholds):
+    """Return exceedance year, return year and overshoot years per threshold
+
+    Batched version of `exceedance()` for a vector of thresholds,
+    e.g., `numpy.arange(1.3, 2.51, 0.05).round(2)`.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    thresholds : array-like
+        threshold values (e.g., temperature in °C)
+
+    Returns
+    -------
+    dict of pandas.DataFrame
+        tables of shape (scenarios, thresholds) for each of
+        'exceedance year', 'return year' and 'overshoot years'
+    """
+    values, years = _matrix(data)
+    thresholds = np.asarray(thresholds, dtype=float).ravel()
+    exceedance_yr, return_yr = _exceedance(values, years, thresholds)
+    columns = pd.Index(thresholds, name='threshold')
+    return {name: pd.DataFrame(value, index=data.index, columns=columns)
+            for name, value in zip(EXCEEDANCE_COLS, [
+                exceedance_yr, return_yr, return_yr - exceedance_yr])}
+
+
+def exceedance(data, threshold):
+    """Return exceedance year, return year and overshoot years per timeseries
+
+    The exceedance year is the first year above `threshold`,
+    the return year is the first year below the threshold after exceedance,
+    both interpolated linearly between reported (non-nan) years.
+    Timeseries starting above the threshold are not assigned an exceedance year.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    threshold : float
+        threshold value (e.g., temperature in °C)
+    """
+    values, years = _matrix(data)
+    exceedance_yr, return_yr = _exceedance(values, years,
+                                           np.array([threshold], dtype=float))
+    return pd.DataFrame(
+        np.column_stack([exceedance_yr, return_yr, return_yr - exceedance_yr]),
+        index=data.index, columns=EXCEEDANCE_COLS)
+
+
+def year_of_net_zero(data, threshold=0):
+    """Return the first year in which a timeseries falls below `threshold`
+
+    Interpolated linearly between reported (non-nan) years;
+    returns `inf` if the timeseries never falls below the threshold.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    threshold : float, default 0
+        threshold value
+    """
+    values, years = _matrix(data)
+    rows = np.arange(len(values))
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore'):
+        k, found = _first(valid & (values < threshold))
+    p = _previous(valid)[rows, k]
+    year = _crossing_year(years[p], values[rows, p], years[k], values[rows, k],
+                          threshold, upwards=False)
+    year = np.where(found, np.where(p >= 0, year, np.nan), np.inf)
+    return pd.Series(year, index=data.index)
+
+
+def value_in_year(data, year):
+    """Return the value of each timeseries in a (scenario-specific) year
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    year : int or array-like
+        year (or vector of years, one per row)
+    """
+    values, years = _matrix(data)
+    year = _as_vector(year, len(values))[:, np.newaxis]
+    value, found = _exact(values, years, ~np.isnan(values), year)
+    return pd.Series(np.where(found, value, np.nan)[:, 0], index=data.index)
+
+
+def year_from_meta(data, meta, default=None):
+    """Return a scenario-specific year from a meta column for each row
+
+    The year (e.g., of peak warming or net-zero emissions) is aligned to the
+    rows of `data` by model and scenario. Missing or infinite values
+    (e.g., no net-zero year) are replaced by `default`, i.e., the last year
+    of `data` (as the function `get_from_meta_column()` originally used
+    in the notebook `sr15_2.0_categories_indicators`). The result can be
+    passed as `first_year` or `last_year` to `cumulative()` or as `year`
+    to `value_in_year()`.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    meta : pandas.Series
+        meta column indexed by model and scenario
+    default : int, optional
+        year used for missing or infinite values,
+        defaults to the last year of `data`
+    """
+    idx = pd.MultiIndex.from_arrays(
+        [data.index.get_level_values(i) for i in META_IDX])
+    year = np.asarray(meta.reindex(idx).values, dtype=float)
+    default = max(data.columns) if default is None else default
+    with np.errstate(invalid='ignore'):
+        return np.where(year < np.inf, year, default)
+
+
+def _bracket(values, years, valid, target):
+    """Last reported year and value strictly before and first reported year
+    and value strictly after `target` (array of years of shape (rows, k)),
+    `nan` if there is no such year"""
+    m = values.shape[1]
+    rows = np.arange(len(values))[:, np.newaxis]
+    cols = np.arange(m)
+    last = np.maximum.accumulate(np.where(valid, cols, -1), axis=1)
+    first = np.minimum.accumulate(np.where(valid, cols, m)[:, ::-1],
+                                  axis=1)[:, ::-1]
+
+    before = np.searchsorted(years, target, side='left') - 1
+    after = np.searchsorted(years, target, side='right')
+    p = np.where(before >= 0, last[rows, np.clip(before, 0, m - 1)], -1)
+    nxt = np.where(after < m, first[rows, np.clip(after, 0, m - 1)], m)
+    has_p, has_n = p >= 0, nxt < m
+    p, nxt = np.clip(p, 0, m - 1), np.clip(nxt, 0, m - 1)
+    return (np.where(has_p, years[p], np.nan), values[rows, p],
+            np.where(has_n, years[nxt], np.nan), values[rows, nxt])
+
+
+def _exact(values, years, valid, target):
+    """Reported value in `target` (array of shape (rows, k)) and whether
+    the year is reported"""
+    rows = np.arange(len(values))[:, np.newaxis]
+    k = np.clip(np.searchsorted(years, target), 0, len(years) - 1)
+    return values[rows, k], (years[k] == target) & valid[rows, k]
+
+
+def _interpolate(values, years, valid, target):
+    """Value in `target` (array of years of shape (rows, k)), interpolated
+    linearly between reported years if not reported (as `pyam.fill_series()`),
+    `nan` outside the range of reported years"""
+    p_yr, p_val, n_yr, n_val = _bracket(values, years, valid, target)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        value = ((n_yr - target) * p_val + (target - p_yr) * n_val) \
+            / (n_yr - p_yr)
+    value = np.where(~np.isnan(p_yr) & ~np.isnan(n_yr), value, np.nan)
+    exact_val, exact = _exact(values, years, valid, target)
+    return np.where(exact, exact_val, value)
+
+
+def annual(data, first_year=None, last_year=None):
+    """Return the timeseries interpolated linearly to an annual grid
+
+    Values in reported years are kept, years between reported years
+    are interpolated linearly (as `pyam.fill_series()`), and years before
+    the first or after the last reported year of a timeseries are `nan`.
+    The sum of the grid from `first_year` to `last_year` equals `cumulative()`
+    up to floating-point rounding (the published indicators are computed
+    in closed form by the other functions of this module).
+
+    Rows are processed in chunks (see `CHUNKSIZE`). The grid is cached
+    as long as `data` exists (by object, not by content, so a table must not
+    be modified in place after calling this function), and the returned table
+    is a read-only view of the cached grid.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    first_year, last_year : int, optional
+        range of the annual grid, defaults to the range of years of `data`
+    """
+    years = np.asarray(data.columns, dtype=int)
+    first_year = int(years.min() if first_year is None else first_year)
+    last_year = int(years.max() if last_year is None else last_year)
+    grid = np.arange(first_year, last_year + 1)
+
+    key = (id(data), first_year, last_year)
+    ref, ret = _ANNUAL.get(key, (None, None))
+    if ref is None or ref() is not data:
+        values, years = _matrix(data)
+        ret = np.empty((len(values), len(grid)))
+        chunk = max(1, CHUNKSIZE // max(1, len(grid) + len(years)))
+        for start in range(0, len(values), chunk):
+            v = values[start:start + chunk]
+            ret[start:start + chunk] = _interpolate(
+                v, years, ~np.isnan(v), grid[np.newaxis, :])
+        ret.flags.writeable = False
+        _ANNUAL[key] = (weakref.ref(data), ret)
+        weakref.finalize(data, _ANNUAL.pop, key, None)
+    return pd.DataFrame(ret, index=data.index, copy=False,
+                        columns=pd.Index(grid, name=data.columns.name))
+
+
+def _fill(values, years, valid, year, start=None):
+    """Value at `year` per row, interpolated linearly if not reported
+
+    This mirrors `pyam.fill_series()`; if `start` (a tuple of year and value
+    per row) is given, this point is considered in addition to the data
+    (`pyam.cumulative()` inserts the interpolated first-year value
+    before filling the last year).
+    """
+    p_yr, p_val, n_yr, n_val = [
+        i[:, 0] for i in _bracket(values, years, valid, year[:, np.newaxis])]
+    has_p, has_n = ~np.isnan(p_yr), ~np.isnan(n_yr)
+
+    if start is not None:
+        s_yr, s_val = start
+        s_valid = ~np.isnan(s_val)
+        use = s_valid & (s_yr < year) & (~has_p | (s_yr > p_yr))
+        p_yr, p_val, has_p = (np.where(use, s_yr, p_yr),
+                              np.where(use, s_val, p_val), has_p | use)
+        use = s_valid & (s_yr > year) & (~has_n | (s_yr < n_yr))
+        n_yr, n_val, has_n = (np.where(use, s_yr, n_yr),
+                              np.where(use, s_val, n_val), has_n | use)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        value = ((n_yr - year) * p_val + (year - p_yr) * n_val) / (n_yr - p_yr)
+    value = np.where(has_p & has_n, value, np.nan)
+
+    exact_val, exact = [i[:, 0] for i in
+                        _exact(values, years, valid, year[:, np.newaxis])]
+    value = np.where(exact, exact_val, value)
+    if start is not None:
+        value = np.where(s_valid & (s_yr == year), s_val, value)
+    return value
+
+
+def _weighted_sum(values, years, first_year, last_year, w_prev, w_next):
+    """Sum of a timeseries from `first_year` to `last_year` (inclusive)
+
+    Each pair of consecutive reported years `(yr, next_yr)` contributes
+    `w_prev(dt) * x[yr] + w_next(dt) * x[next_yr]` with `dt = next_yr - yr`,
+    and the value in `last_year` is added explicitly. The terms are summed
+    sequentially in the order of years (as in `pyam.cumulative()`)
+    so that the result is identical to the row-wise implementation.
+    """
+    rows = np.arange(len(values))
+    valid = ~np.isnan(values)
+    first, last = first_year, last_year
+
+    first_val = _fill(values, years, valid, first)
+    last_val = _fill(values, years, valid, last, start=(first, first_val))
+
+    col = years[np.newaxis, :]
+    inner = valid & (col > first[:, np.newaxis]) & (col < last[:, np.newaxis])
+    prev = _previous(inner)
+    prev_yr = np.where(prev >= 0, years[prev], first[:, np.newaxis])
+    prev_val = np.where(prev >= 0, values[rows[:, np.newaxis], prev],
+                        first_val[:, np.newaxis])
+
+    terms = np.zeros((len(values), len(years) + 1))
+    with np.errstate(invalid='ignore'):
+        dt = np.where(inner, col - prev_yr, 0)
+        terms[:, :-1] = np.where(
+            inner, w_prev(dt) * prev_val + w_next(dt) * values, 0)
+
+        k, has_inner = _last(inner)
+        prev_yr = np.where(has_inner, years[k], first)
+        prev_val = np.where(has_inner, values[rows, k], first_val)
+        dt = last - prev_yr
+        terms[:, -1] = np.where(
+            last > first, w_prev(dt) * prev_val + w_next(dt) * last_val, 0)
+
+    value = np.cumsum(terms, axis=1)[:, -1] + last_val
+
+    in_range = (years.min() <= first) & (years.max() >= last)
+    return np.where(in_range & ~np.isnan(first_val) & ~np.isnan(last_val),
+                    value, np.nan)
+
+
+def cumulative(data, first_year, last_year):
+    """Return the cumulative sum of each timeseries over a range of years
+
+    This is a vectorized implementation of `pyam.cumulative()`: values are
+    interpolated linearly between reported years, and both `first_year`
+    and `last_year` are included in the sum. Returns `nan` if the timeseries
+    table does not cover the range `[first_year, last_year]`.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    first_year, last_year : int or array-like
+        first and last year of the sum (scalar or vector, one per row)
+    """
+    values, years = _matrix(data)
+    n = len(values)
+    value = _weighted_sum(values, years,
+                          _as_vector(first_year, n), _as_vector(last_year, n),
+                          w_prev=lambda dt: (dt + 1) / 2,
+                          w_next=lambda dt: (dt - 1) / 2)
+    return pd.Series(value, index=data.index)
+
+
+def overshoot_severity(data, exceedance_year, return_year, threshold):
+    """Return the sum of values exceeding `threshold` during the overshoot
+
+    The sum covers the years from `exceedance_year` until the year before
+    `return_year`; returns `nan` if the timeseries does not return.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    exceedance_year, return_year : array-like
+        exceedance and return year, one per row (see `exceedance()`)
+    threshold : float
+        threshold value (e.g., temperature in °C)
+    """
+    n = len(data)
+    first = _as_vector(exceedance_year, n)
+    last = _as_vector(return_year, n) - 1
+    with np.errstate(invalid='ignore'):
+        overshoots = (first > 0) & (last > 0)
+    value = cumulative(data, np.where(overshoots, first, 0),
+                       np.where(overshoots, last, 0)).values \
+        - (last - first + 1) * threshold
+    return pd.Series(np.where(overshoots, value, np.nan), index=data.index)
+
+
+def npv_weighted(data, first_year, last_year, w1_function, w2_function, r):
+    """Return the average weighted net-present value over a range of years
+
+    This is a vectorized implementation of the function `npv_weighted()`
+    originally used in the notebook `sr15_2.0_categories_indicators`
+    (see `test_indicators.py`).
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        wide timeseries table (rows: scenarios, columns: years)
+    first_year, last_year : int
+        first and last year of the NPV horizon (inclusive)
+    w1_function, w2_function : function
+        weights `w(r, dt)` of the earlier and later year of each time step
+    r : float
+        discount rate
+    """
+    values, years = _matrix(data)
+    n = len(values)
+
+    def weights(func):
+        def _weights(dt):
+            w = np.full(dt.shape, np.nan)
+            for i in np.unique(dt[dt > 0]):
+                w[dt == i] = func(r, int(i))
+            return w
+        return _weights
+
+    value = _weighted_sum(values, years,
+                          _as_vector(first_year, n), _as_vector(last_year, n),
+                          w_prev=weights(w1_function),
+                          w_next=weights(w2_function))
+    return pd.Series(value / (last_year - first_year + 1), index=data.index)
+
+
+def warming_indicators(temperature, thresholds=(1.5, 2.0)):
+    """Compute all warming indicators from one temperature timeseries table
+
+    Returns a table with peak warming, year of peak warming, warming in 2100,
+    the peak-and-decline indicator and (for each threshold) the exceedance
+    year, return year, overshoot years and exceedance severity.
+
+    Parameters
+    ----------
+    temperature : pandas.DataFrame
+        wide timeseries table of warming (rows: scenarios, columns: years)
+    thresholds : list of float, default (1.5, 2.0)
+        warming thresholds
+    """
+    peak = peak_warming(temperature)
+    ret = pd.DataFrame({
+        'peak warming': peak['value'],
+        'year of peak warming': peak['year'],
+        'warming in 2100': value_in_year(temperature, 2100),
+    })
+    ret['peak-and-decline'] = ret['peak warming'] - ret['warming in 2100']
+
+    ex = exceedance_grid(temperature, thresholds)
+    for t in ex['exceedance year'].columns:
+        for col in EXCEEDANCE_COLS:
+            ret['{}|{}°C'.format(col, t)] = ex[col][t]
+        ret['exceedance severity|{}°C'.format(t)] = overshoot_severity(
+            temperature, ex['exceedance year'][t], ex['return year'][t], t)
+
+    return ret
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Loading of the scenario ensemble snapshot for the notebooks
+of the IPCC SR15 scenario assessment
+
+Parsing the IAMC-format workbook is by far the slowest step when (re-)running
+the notebooks. The first call of `load_snapshot()` therefore converts
+the timeseries data to a columnar (Arrow/Feather) file in a cache folder
+next to the source file; every later call reads directly from that file.
+The cache file is keyed by a content hash of the source file,
+so it is invalidated automatically when the snapshot is updated.
+
+The function `load_scenarios()` loads the snapshot together with the metadata
+(categorization and indicators) in one step, replacing the pair
+`IamDataFrame(data=...)` and `IamDataFrame.load_metadata()`.
+The cache files are read as memory-mapped Arrow tables (kept open for
+repeated calls within one process), so no notebook parses the source files.
+Note that each notebook still builds its own `pyam.IamDataFrame`, i.e.,
+a (validated) copy in memory of the data that it loads; the memory needed
+per notebook is bounded by selecting only the variables and years it uses.
+If the metadata were exported as binary tables (see `export.py`),
+`load_meta()` reads the meta table directly from these tables.
+
+The timeseries data in the cache are sorted by variable, and the range
+of rows of each variable is stored in the metadata of the Arrow schema.
+A selection of variables and years passed to `load_snapshot()` or
+`load_scenarios()` is applied to the memory-mapped table (by slicing the
+row range of each variable) before any data are converted to pandas,
+so that a notebook only materializes the data that it uses.
+"""
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyam
+from pyam.utils import islistable, pattern_match
+
+import export
+from profiling import stage
+
+logger = pyam.logger()
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    from pyarrow import feather
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+CACHE_FOLDER = '.cache'
+HASH_BLOCKSIZE = 2 ** 20
+HASH_LENGTH = 16
+IAMC_COLS = ['model', 'scenario', 'region', 'variable', 'unit', 'year', 'value']
+META_IDX = ['model', 'scenario']
+SORT_COLS = ['variable', 'model', 'scenario', 'region', 'year']
+VARIABLE_INDEX = 'variable_index'
+
+# memory-mapped tables of cache files read in this process
+_STORE = {}
+
+
+def file_hash(path):
+    """Return the sha256 hex digest of the content of a file"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCKSIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_stem(path, cache_dir=None):
+    folder, name = os.path.split(os.path.abspath(path))
+    cache_dir = cache_dir or os.path.join(folder, CACHE_FOLDER)
+    return os.path.join(cache_dir, os.path.splitext(name)[0])
+
+
+def cache_path(path, cache_dir=None):
+    """Return the path of the cache file for a snapshot file
+
+    Parameters
+    ----------
+    path : str
+        path to the IAMC-format snapshot (`xlsx` or `csv`)
+    cache_dir : str, optional
+        folder for cache files, defaults to `.cache` next to the source file
+    """
+    return '{}_{}.feather'.format(_cache_stem(path, cache_dir),
+                                  file_hash(path)[:HASH_LENGTH])
+
+
+def _write_cache(data, cache, metadata=None):
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    # remove cache files of previous versions of the same snapshot
+    stem = cache.rsplit('_', 1)[0]
+    for f in glob.glob('{}_{}.feather'.format(stem, '?' * HASH_LENGTH)):
+        os.remove(f)
+    # write to a temporary file first so that notebooks running in parallel
+    # never read a partially written cache file
+    # the cache is written uncompressed so that it can be memory-mapped
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())
+    table = pyarrow.Table.from_pandas(data.reset_index(drop=True),
+                                      preserve_index=False)
+    if metadata:
+        metadata = dict(table.schema.metadata or {}, **metadata)
+        table = table.replace_schema_metadata(metadata)
+    feather.write_feather(table, tmp, compression='uncompressed')
+    os.replace(tmp, cache)
+
+
+def _read_table(cache):
+    """Return the memory-mapped Arrow table of a cache file"""
+    if cache not in _STORE:
+        _STORE[cache] = feather.read_table(cache, memory_map=True)
+    return _STORE[cache]
+
+
+def _read_cache(cache):
+    """Read a cache file via a memory-mapped Arrow table"""
+    return _read_table(cache).to_pandas(split_blocks=True)
+
+
+def _sort_data(data):
+    """Sort timeseries data by variable and return the row range
+    of each variable (as schema metadata of the cache file)"""
+    data = data.sort_values(SORT_COLS).reset_index(drop=True)
+    variables = data['variable'].unique()
+    start = data['variable'].searchsorted(variables, side='left')
+    stop = data['variable'].searchsorted(variables, side='right')
+    index = {v: [int(a), int(b)] for v, a, b in zip(variables, start, stop)}
+    return data, {VARIABLE_INDEX: json.dumps(index)}
+
+
+def read_snapshot(cache, variable=None, year=None):
+    """Read the timeseries data of selected variables and years
+    from a snapshot cache file
+
+    The variables are selected as slices of the memory-mapped table
+    (using the row range of each variable), and the years are filtered
+    on the (much smaller) slices before converting to pandas.
+
+    Parameters
+    ----------
+    cache : str
+        path to the cache file (see `cache_path()`)
+    variable : str or list of str, optional
+        variables to be included (with `*` as wildcard,
+        as `pyam.IamDataFrame.filter()`), defaults to all variables
+    year : int or list of int, optional
+        years to be included, defaults to all years
+    """
+    table = _read_table(cache)
+    if variable is not None:
+        metadata = table.schema.metadata or {}
+        if VARIABLE_INDEX.encode() in metadata:
+            index = json.loads(metadata[VARIABLE_INDEX.encode()])
+            names = pd.Series(list(index))
+            keep = names[pattern_match(names, variable)]
+            slices = [table.slice(index[v][0], index[v][1] - index[v][0])
+                      for v in keep]
+            table = pyarrow.concat_tables(slices) if slices \
+                else table.slice(0, 0)
+        else:  # cache file written without index, filter all rows
+            names = pd.Series(table['variable'].unique().to_pylist())
+            keep = pyarrow.array(list(names[pattern_match(names, variable)]),
+                                 table.schema.field('variable').type)
+            table = table.filter(pyarrow.compute.is_in(table['variable'],
+                                                       value_set=keep))
+    if year is not None:
+        years = pyarrow.array(list(year) if islistable(year) else [year],
+                              table.schema.field('year').type)
+        table = table.filter(pyarrow.compute.is_in(table['year'],
+                                                   value_set=years))
+    return table.to_pandas(split_blocks=True)
+
+
+@stage('load_snapshot')
+def load_snapshot(path, cache_dir=None, variable=None, year=None):
+    """Load an IAMC-format snapshot as `pyam.IamDataFrame` via a binary cache
+
+    Parameters
+    ----------
+    path : str
+        path to the IAMC-format snapshot (`xlsx` or `csv`)
+    cache_dir : str, optional
+        folder for cache files, defaults to `.cache` next to the source file
+    variable : str or list of str, optional
+        only load these variables (with `*` as wildcard)
+    year : int or list of int, optional
+        only load these years
+    """
+    select = variable is not None or year is not None
+    if not HAS_ARROW:
+        logger.warning('`pyarrow` is not installed, parsing `{}` without cache'
+                       .format(path))
+        df = pyam.IamDataFrame(data=path)
+        return df.filter(variable=variable, year=year) if select else df
+
+    cache = cache_path(path, cache_dir)
+    if not os.path.exists(cache):
+        df = pyam.IamDataFrame(data=path)
+        data, metadata = _sort_data(df.data[IAMC_COLS])
+        _write_cache(data, cache, metadata)
+        if not select:
+            return df
+    return pyam.IamDataFrame(read_snapshot(cache, variable, year))
+
+
+def _read_meta(path):
+    """Read the meta table of a metadata file (as `load_metadata()`)"""
+    if path.endswith('csv'):
+        return pd.read_csv(path)
+    sheets = pd.ExcelFile(path).sheet_names
+    return pd.read_excel(path, sheet_name='meta' if len(sheets) > 1 else 0)
+
+
+@stage('load_meta')
+def load_meta(path, cache_dir=None):
+    """Load the meta table of a metadata file via a binary cache
+
+    The meta table is read from the binary tables written by
+    `export.write_tables()` for this path if they exist.
+
+    Parameters
+    ----------
+    path : str
+        path to the metadata file (`xlsx` or `csv`),
+        e.g. `sr15_metadata_indicators.xlsx`
+    cache_dir : str, optional
+        folder for cache files, defaults to `.cache` next to the source file
+    """
+    if export.exists(path):
+        sheets = export.sheets(path)
+        sheet = 'meta' if 'meta' in sheets else sheets[0]
+        return export.read_table(path, sheet).reset_index()
+    if not os.path.exists(path):
+        raise ValueError("no metadata file '{}' found!".format(path))
+    if not HAS_ARROW:
+        return _read_meta(path)
+
+    cache = cache_path(path, cache_dir)
+    if os.path.exists(cache):
+        return _read_cache(cache)
+
+    meta = _read_meta(path)
+    try:
+        _write_cache(meta, cache)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as e:
+        # columns of mixed types cannot be stored as Arrow table
+        logger.info('not caching metadata file `{}`: {}'.format(path, e))
+    return meta
+
+
+def set_meta_table(df, meta):
+    """Merge a meta table into a `pyam.IamDataFrame` (as `load_metadata()`)"""
+    req_cols = META_IDX + ['exclude']
+    if not set(req_cols).issubset(meta.columns):
+        raise ValueError('metadata does not have required columns ({})!'
+                         .format(req_cols))
+
+    meta = meta.set_index(META_IDX)
+    idx = df.meta.index.intersection(meta.index)
+    n_invalid = len(meta) - len(idx)
+    if n_invalid > 0:
+        logger.info('Ignoring {} scenario{} from imported metadata'
+                    .format(n_invalid, 's' if n_invalid > 1 else ''))
+    if idx.empty:
+        raise ValueError('No valid scenarios in imported metadata file!')
+
+    columns = list(df.meta.columns) \
+        + [i for i in meta.columns if i not in df.meta.columns]
+    df.meta = meta.loc[idx].combine_first(df.meta)[columns]
+    df.meta['exclude'] = df.meta['exclude'].astype('bool')
+
+
+def load_scenarios(path, meta=None, cache_dir=None, variable=None,
+                   year=None, **filters):
+    """Load an IAMC-format snapshot and its metadata as `pyam.IamDataFrame`
+
+    Parameters
+    ----------
+    path : str
+        path to the IAMC-format snapshot (`xlsx` or `csv`)
+    meta : str, optional
+        path to the metadata file (`xlsx` or `csv`),
+        e.g. `sr15_metadata_indicators.xlsx`
+    cache_dir : str, optional
+        folder for cache files, defaults to `.cache` next to the source files
+    variable : str or list of str, optional
+        only load these variables (with `*` as wildcard)
+    year : int or list of int, optional
+        only load these years
+    filters
+        filters by columns of the metadata (e.g., `category=...`),
+        applied after merging the metadata
+    """
+    df = load_snapshot(path, cache_dir, variable=variable, year=year)
+    if meta is not None:
+        set_meta_table(df, load_meta(meta, cache_dir))
+    if filters:
+        df = df.filter(**filters)
+    return df
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Operators on timeseries data for the IPCC SR15 scenario assessment
+
+The timeseries of all variables needed for an indicator are pivoted once
+to a matrix by scenario (columns: variable, year). Shares of components
+in a total and changes relative to a base year are then computed
+for all variables and years at once, without filtering (or changing the
+`exclude` column of) the source `pyam.IamDataFrame`.
+
+The difference of each scenario to its baseline (the column `baseline`
+in the metadata) is computed as one gather-and-subtract operation over
+the timeseries table, using the baseline as join key.
+"""
+import numpy as np
+import pandas as pd
+import pyam
+
+META_IDX = ['model', 'scenario']
+
+
+def pivot(df, variables, years=None, exclude=None):
+    """Return the timeseries of `variables` as one matrix by scenario
+
+    Parameters
+    ----------
+    df : pyam.IamDataFrame or pandas.DataFrame
+        timeseries data (or data in long IAMC format)
+    variables : list of str
+        variables to be included
+    years : list of int, optional
+        years to be included (default: all)
+    exclude : bool, optional
+        only include scenarios with this value of `exclude` in `df.meta`
+
+    Returns
+    -------
+    pandas.DataFrame
+        values (summed over regions) indexed by model and scenario,
+        with columns variable and year
+    """
+    data = df.data if isinstance(df, pyam.IamDataFrame) else df
+    keep = data['variable'].isin(variables).values
+    if years is not None:
+        keep &= data['year'].isin(years).values
+    if exclude is not None:
+        meta = df.meta.index[df.meta['exclude'] == exclude]
+        keep &= pd.MultiIndex.from_arrays([data[i] for i in META_IDX])\
+            .isin(meta)
+
+    return (
+        data[keep].groupby(META_IDX + ['variable', 'year'])['value'].sum()
+        .unstack(['variable', 'year']).sort_index(axis=1)
+    )
+
+
+def relative_change(data, base_year, years=None, percent=True):
+    """Return the change relative to a base year, i.e.,
+    `(data[y] / data[base_year] - 1) * 100`, for all years (and variables)
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        timeseries with year columns, or a matrix as returned by `pivot()`
+    base_year : int
+        year of reference
+    years : list of int, optional
+        years to be compared (default: all except `base_year`)
+    percent : bool, default True
+        return the change in percent (else as fraction)
+    """
+    if isinstance(data.columns, pd.MultiIndex):
+        _years = data.columns.get_level_values('year')
+        years = years or [y for y in _years.unique() if y != base_year]
+        base = data.xs(base_year, axis=1, level='year').reindex(
+            columns=data.columns.get_level_values('variable'))
+        ret = data / base.values
+        ret = ret.loc[:, _years.isin(years)]
+    else:
+        years = years or [y for y in data.columns if y != base_year]
+        ret = data[years].div(data[base_year], axis=0)
+    return (ret - 1) * 100 if percent else ret - 1
+
+
+def share(data, components, total, percent=True):
+    """Return the share of the sum of `components` in `total` by year
+
+    Only scenarios reporting all components (in any year) are included,
+    as with `require_variable(..., exclude_on_fail=True)` for each component.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        matrix as returned by `pivot()`
+    components : list of str
+        variables to be summed
+    total : str or pandas.DataFrame
+        variable in `data`, or timeseries indexed by model and scenario
+        with year columns
+    percent : bool, default True
+        return the share in percent (else as fraction)
+    """
+    _data = data.reindex(columns=components, level='variable')
+    keep = (
+        _data.notnull().T.groupby(level='variable').any()
+        .reindex(components, fill_value=False).all().values
+    )
+
+    component = _data[keep].T.groupby(level='year').sum().T
+    if not isinstance(total, pd.DataFrame):
+        total = data[total]
+    return component / total * (100 if percent else 1)
+
+
+def difference_to_baseline(data, baseline, fallback=None, variable=None):
+    """Return the difference of the timeseries of each scenario
+    to the timeseries of its baseline scenario
+
+    The baseline of a row is the row of the same model, region, variable
+    (and any other index level) with the baseline scenario as scenario.
+    Scenarios without a baseline (or whose baseline does not report
+    the timeseries) can be filled from a `fallback` table, e.g., a variable
+    reported directly by the scenario.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        timeseries table (e.g., `df.timeseries()`) with one row per index
+    baseline : pandas.Series
+        baseline scenario of each scenario, indexed by model and scenario
+        (e.g., `df.meta['baseline']`)
+    fallback : pandas.DataFrame, optional
+        timeseries table (indexed as `data`) used for scenarios
+        without a difference to baseline
+    variable : str, optional
+        name of the variable of the returned timeseries
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed as `data`, only including rows with at least one value
+    """
+    rows = data.index.to_frame(index=False)
+    base = baseline.reindex(pd.MultiIndex.from_frame(rows[META_IDX]))
+    rows['scenario'] = base.values
+    pos = data.index.get_indexer(pd.MultiIndex.from_frame(rows))
+
+    values = np.asarray(data.values, dtype=float)
+    ret = np.full(values.shape, np.nan)
+    has_base = pos >= 0
+    ret[has_base] = values[has_base] - values[pos[has_base]]
+    keep = ~np.isnan(ret).all(axis=1)
+    ret = pd.DataFrame(ret[keep], index=data.index[keep], columns=data.columns)
+
+    if fallback is not None:
+        done = pd.MultiIndex.from_arrays(
+            [ret.index.get_level_values(i) for i in META_IDX])
+        idx = pd.MultiIndex.from_arrays(
+            [fallback.index.get_level_values(i) for i in META_IDX])
+        ret = pd.concat([ret, fallback[~idx.isin(done)]], sort=False)
+
+    if variable is not None:
+        index = ret.index.to_frame(index=False)
+        index['variable'] = variable
+        ret.index = pd.MultiIndex.from_frame(index)
+    return ret
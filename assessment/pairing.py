@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pairs of corresponding scenarios for the IPCC SR15 scenario assessment
+
+Scenarios are compared in pairs of variants of the same policy design
+(e.g., `SSP1-19` and `SSP1-26` as the 1.5°C and 2°C variant of `SSP1`),
+defined in a rule table with the columns `scenario_a`, `scenario_b`
+and `pair` (and optionally `model` for rules that apply to one model only,
+`nan` for rules that apply to all models).
+
+`join_index()` matches the rules against the rows of a timeseries table
+in one hash join and returns an explicit integer join index, i.e.,
+the rows of scenario a and b of each (model, pair). Relative differences
+are then computed by `relative()` as one gather-and-divide operation
+for all pairs and years, and `describe()` computes descriptive statistics
+by group (e.g., category of scenario a) in one grouped reduction.
+"""
+import numpy as np
+import pandas as pd
+
+from stats_tables import describe as _describe
+
+META_IDX = ['model', 'scenario']
+RULE_COLS = ['scenario_a', 'scenario_b', 'pair']
+
+
+def rule_table(rules):
+    """Return a rule table as `pandas.DataFrame`
+
+    Parameters
+    ----------
+    rules : list of tuples or pandas.DataFrame
+        tuples `(scenario_a, scenario_b, pair)` or table with these columns
+        (and optionally `model`)
+    """
+    if not isinstance(rules, pd.DataFrame):
+        return pd.DataFrame(list(rules), columns=RULE_COLS)
+    missing = set(RULE_COLS) - set(rules.columns)
+    if missing:
+        raise ValueError('missing required columns `{}` in rule table'
+                         .format(sorted(missing)))
+    return rules
+
+
+def _match(rows, rules, on):
+    """Match rules (with the columns `on` as additional join keys)
+    against the rows of a timeseries table"""
+    sides = []
+    for side in ['a', 'b']:
+        match = rows.merge(rules, left_on=on + ['scenario'],
+                           right_on=on + ['scenario_{}'.format(side)])
+        sides.append(match[['model', 'pair', 'row']]
+                     .rename(columns={'row': side}))
+    ret = sides[0].merge(sides[1], on=['model', 'pair'], how='outer')
+    return ret.merge(rules[on + RULE_COLS], on=on + ['pair'])
+
+
+def join_index(data, rules):
+    """Return the rows of the scenarios of each pair
+
+    Rules with a `model` apply to that model only and take precedence
+    over a rule of the same pair without `model` (i.e., `nan`),
+    which applies to all models.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame or pandas.MultiIndex
+        timeseries table (or its index) with one row per model and scenario
+    rules : list of tuples or pandas.DataFrame
+        rule table (see `rule_table()`)
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed by model and pair, with the columns `scenario_a`,
+        `scenario_b` and the integer positions `a` and `b` of the scenarios
+        in `data` (-1 if the scenario is not in `data`)
+    """
+    index = getattr(data, 'index', data)
+    rules = rule_table(rules)
+    on = ['model'] if 'model' in rules.columns else []
+    if rules.duplicated(on + ['pair']).any():
+        raise ValueError('duplicate pairs in rule table')
+
+    rows = pd.DataFrame({i: index.get_level_values(i) for i in META_IDX})
+    if rows.duplicated().any():
+        raise ValueError('`data` must have one row per model and scenario')
+    rows['row'] = np.arange(len(rows))
+
+    if on:
+        generic = rules['model'].isnull()
+        matches = [_match(rows, rules[generic].drop(columns='model'), [])]
+        if not generic.all():
+            # model-specific rules are listed first to take precedence
+            matches.insert(0, _match(rows, rules[~generic], on))
+        ret = pd.concat(matches, sort=False)\
+            .drop_duplicates(['model', 'pair'])
+    else:
+        ret = _match(rows, rules, on)
+    ret[['a', 'b']] = ret[['a', 'b']].fillna(-1).astype(int)
+    return ret.set_index(['model', 'pair']).sort_index()[
+        ['scenario_a', 'scenario_b', 'a', 'b']]
+
+
+def relative(data, pairs, change=False):
+    """Return the ratio of scenario a to scenario b of all complete pairs
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        timeseries table (rows: scenarios, columns: years), only numeric
+        columns are included
+    pairs : pandas.DataFrame
+        join index as returned by `join_index()` for `data`
+    change : bool, default False
+        return the relative change `a / b - 1` instead of the ratio
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed as `data`, with the name of the pair as scenario
+    """
+    pairs = pairs[(pairs['a'] >= 0) & (pairs['b'] >= 0)]
+    data = data.select_dtypes(include=[np.number])
+    values = np.asarray(data.values, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = values[pairs['a'].values] / values[pairs['b'].values]
+    if change:
+        ret -= 1
+
+    index = data.index[pairs['a'].values].to_frame(index=False)
+    index['scenario'] = pairs.index.get_level_values('pair')
+    return pd.DataFrame(ret, index=pd.MultiIndex.from_frame(index),
+                        columns=data.columns).sort_index()
+
+
+def pair_meta(data, pairs, meta=None, side='a'):
+    """Return the scenario (or a meta column of it) of one side of each pair,
+    aligned to the rows of a table returned by `relative()`
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        table indexed by model and pair (as scenario)
+    pairs : pandas.DataFrame
+        join index as returned by `join_index()`
+    meta : pandas.Series, optional
+        meta column indexed by model and scenario (e.g., `df.meta['category']`),
+        returns the name of the scenario if not given
+    side : str, default 'a'
+        side of the pair, 'a' or 'b'
+    """
+    values = pairs['scenario_{}'.format(side)]
+    if meta is not None:
+        values = meta.reindex(pd.MultiIndex.from_arrays(
+            [pairs.index.get_level_values('model'), values])).values
+    lookup = pd.Series(values, index=pairs.index)
+    rows = pd.MultiIndex.from_arrays(
+        [data.index.get_level_values(i) for i in META_IDX])
+    return pd.Series(lookup.reindex(rows).values, index=data.index,
+                     name=getattr(meta, 'name', 'scenario_{}'.format(side)))
+
+
+def describe(data, by=None, percentiles=[0.25, 0.5, 0.75]):
+    """Return descriptive statistics (as `pandas.DataFrame.describe()`)
+    of each column, by group
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        table (only numeric columns are included)
+    by : array-like, optional
+        group of each row (rows with `nan` are excluded),
+        all rows are one group if not given
+    percentiles : list of float
+        percentiles to be computed
+
+    Returns
+    -------
+    pandas.DataFrame
+        index: statistic (or group and statistic if `by` is given)
+    """
+    data = data.select_dtypes(include=[np.number])
+    values = np.asarray(data.values, dtype=float)
+    n, m = values.shape
+    if by is None:
+        codes, groups = np.zeros(n, dtype=int), None
+    else:
+        codes, groups = pd.factorize(np.asarray(by, dtype=object), sort=True)
+    n_groups = 1 if groups is None else len(groups)
+
+    keep = codes >= 0
+    key = (codes[keep, np.newaxis] * m + np.arange(m)).ravel()
+    stats = _describe(key, values[keep].ravel(), n_groups * m, percentiles)
+    stats = stats.reshape(n_groups, m, -1).transpose(0, 2, 1)
+
+    rows = ['count', 'mean', 'std', 'min'] \
+        + ['{:g}%'.format(p * 100) for p in percentiles] + ['max']
+    if groups is None:
+        return pd.DataFrame(stats[0], index=rows, columns=data.columns)
+    index = pd.MultiIndex.from_product([groups, rows])
+    return pd.DataFrame(stats.reshape(-1, m), index=index,
+                        columns=data.columns)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dependency-aware runner for the notebooks of the IPCC SR15 scenario assessment
+
+The runner reads the input and output files of each notebook from its code
+(e.g., `load_metadata('sr15_metadata_indicators.xlsx')` is an input,
+`pd.ExcelWriter('output/...xlsx')` or `fig.savefig('output/...png')` an
+output) and derives the dependency graph: a notebook depends on every notebook
+that writes one of its inputs. Notebooks whose dependencies are complete are
+executed in parallel on a process pool.
+
+A notebook is skipped if its source, the local modules it imports
+and its input files are unchanged since its last successful run
+and all its outputs exist. The state is kept in `.cache/pipeline.json`.
+
+Tables written by `export.write_tables()` count as outputs of a notebook
+by the path of their workbook; the workbooks themselves are only written
+with `--excel` (in parallel, after all notebooks are run).
+
+With `--profile FOLDER`, the stages instrumented by `profiling.stage`
+(loading, statistics, plotting and the execution of each notebook) are
+recorded and merged into one trace of the run (see `profiling.py`).
+
+Usage (from the `assessment` folder):
+
+    python pipeline.py [-j JOBS] [--force] [--dry-run] [--excel]
+                       [--profile FOLDER] [notebook ...]
+"""
+import argparse
+import concurrent.futures
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import re
+
+import pyam
+
+import export
+import profiling
+from incremental import REBUILD_ENV, UpToDate
+from loader import file_hash
+
+logger = pyam.logger()
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(HERE, '.cache', 'pipeline.json')
+FILE_TYPES = ['csv', 'feather', 'json', 'mplstyle', 'parquet', 'pdf', 'png',
+              'svg', 'xls', 'xlsx', 'yaml', 'yml']
+WRITE_MARKERS = ['ExcelWriter(', 'savefig(', '.to_excel(', '.to_csv(',
+                 'save=', "'save':", "'w'", '"w"', 'write_', 'Figure(',
+                 '.dump(']
+
+_STRING = re.compile(r'''(['"])([\w./{}-]+\.(?:\w+|\{\}))\1''')
+_ASSIGN = re.compile(r'''^\s*(\w+)\s*=\s*['"]''')
+_IMPORT = re.compile(r'^\s*(?:from\s+(\w+)\s+import|import\s+(\w+))', re.M)
+_SYS_PATH = re.compile(r'''sys\.path\.append\(\s*['"]([^'"]+)['"]\s*\)''')
+
+
+def _code(path):
+    """Return the source code of a notebook (or python module)"""
+    with open(path, encoding='utf8') as f:
+        if not path.endswith('.ipynb'):
+            return f.read()
+        nb = json.load(f)
+    return '\n'.join(''.join(c['source']) for c in nb['cells']
+                     if c['cell_type'] == 'code')
+
+
+def _is_file(name):
+    ext = name.rsplit('.', 1)[-1]
+    return ext == '{}' or ext in FILE_TYPES
+
+
+def _pattern(folder, name):
+    """Absolute path (or glob pattern for formatted strings) of a file"""
+    return os.path.normpath(os.path.join(folder, re.sub(r'\{[^}]*\}', '*',
+                                                        name)))
+
+
+class Notebook(object):
+    """Inputs, outputs and local modules of a notebook"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(path)
+        folder = os.path.dirname(self.path)
+        code = _code(self.path)
+
+        lines = code.split('\n')
+        variables = {}
+        for line in lines:
+            match = _ASSIGN.match(line)
+            if match:
+                for _, s in _STRING.findall(line):
+                    variables[match.group(1)] = s
+
+        files, written = set(), set()
+        for line in lines:
+            names = [s for _, s in _STRING.findall(line) if _is_file(s)]
+            files.update(names)
+            if any(m in line for m in WRITE_MARKERS):
+                written.update(names)
+                written.update(s for v, s in variables.items()
+                               if re.search(r'\b{}\b'.format(v), line))
+
+        self.outputs = sorted(_pattern(folder, s) for s in written)
+        self.inputs = sorted(_pattern(folder, s) for s in files - written)
+
+        module_dirs = [folder] + [os.path.normpath(os.path.join(folder, p))
+                                  for p in _SYS_PATH.findall(code)]
+        self.modules = sorted(_local_modules(code, module_dirs))
+
+    def depends_on(self, other):
+        """Whether any input of this notebook is an output of `other`"""
+        return other is not self and any(
+            i == o or fnmatch.fnmatch(i, o) or fnmatch.fnmatch(o, i)
+            for i in self.inputs for o in other.outputs)
+
+    def fingerprint(self):
+        """Hash of the notebook source, local modules and input files"""
+        h = hashlib.sha256()
+        for path in [self.path] + self.modules + self.inputs:
+            files = export.files(path) or sorted(glob.glob(path)) or [path]
+            for f in files:
+                h.update(f.encode('utf8'))
+                h.update((file_hash(f) if os.path.isfile(f) else 'missing')
+                         .encode('utf8'))
+        return h.hexdigest()
+
+    def outputs_exist(self):
+        return all(glob.glob(o) or export.exists(o) for o in self.outputs)
+
+
+def _local_modules(code, module_dirs, seen=None):
+    """Return the paths of local modules imported (recursively) by `code`"""
+    seen = set() if seen is None else seen
+    for names in _IMPORT.findall(code):
+        for name in filter(None, names):
+            for folder in module_dirs:
+                path = os.path.join(folder, '{}.py'.format(name))
+                if os.path.isfile(path) and path not in seen:
+                    seen.add(path)
+                    _local_modules(_code(path), module_dirs, seen)
+    return seen
+
+
+def dependencies(notebooks):
+    """Return the dependency graph as a dictionary of sets of notebook names"""
+    return {nb.name: {other.name for other in notebooks if nb.depends_on(other)}
+            for nb in notebooks}
+
+
+def _read_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def _write_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(STATE_FILE, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, STATE_FILE)
+
+
+def execute(path, timeout=None, executed_dir=None, rebuild=False):
+    """Execute a notebook in its folder (in a worker process)
+
+    Returns whether the notebook stopped early (raising
+    `incremental.UpToDate`) because its outputs are up to date.
+    If `rebuild`, incremental notebooks process all scenarios
+    (see `incremental.rebuild_requested()`).
+    """
+    import nbformat
+    from nbconvert.preprocessors import CellExecutionError, ExecutePreprocessor
+
+    # the kernel inherits the environment, so that its stages are attributed
+    # to this notebook when profiling is enabled
+    profiling.set_notebook(os.path.basename(path))
+    if rebuild:
+        os.environ[REBUILD_ENV] = '1'
+    else:
+        os.environ.pop(REBUILD_ENV, None)
+    nb = nbformat.read(path, as_version=4)
+    ep = ExecutePreprocessor(timeout=timeout, kernel_name='python3')
+    up_to_date = False
+    with profiling.stage('execute', rows=len(nb.cells)):
+        try:
+            ep.preprocess(nb, {'metadata': {'path': os.path.dirname(path)}})
+        except CellExecutionError as e:
+            # the notebook stopped early because its outputs are unchanged
+            if getattr(e, 'ename', None) != UpToDate.__name__:
+                raise
+            up_to_date = True
+    if executed_dir is not None:
+        os.makedirs(executed_dir, exist_ok=True)
+        nbformat.write(nb, os.path.join(executed_dir, os.path.basename(path)))
+    return up_to_date
+
+
+def run(paths, jobs=None, force=False, dry_run=False, timeout=None,
+        executed_dir=None):
+    """Run notebooks in dependency order, in parallel where possible
+
+    Parameters
+    ----------
+    paths : list of str
+        notebooks to be run
+    jobs : int, optional
+        number of worker processes, defaults to the number of cores
+    force : bool, default False
+        run all notebooks even if their inputs are unchanged
+        (incremental notebooks then process all scenarios)
+    dry_run : bool, default False
+        only log the execution plan
+    timeout : int, optional
+        timeout (seconds) for each cell
+    executed_dir : str, optional
+        folder to save the executed notebooks (with outputs)
+
+    Returns
+    -------
+    dict
+        status of each notebook: 'done', 'skipped', 'failed' or 'blocked'
+    """
+    notebooks = {nb.name: nb for nb in map(Notebook, paths)}
+    graph = dependencies(list(notebooks.values()))
+    state = _read_state()
+    status, rerun = {}, set()
+
+    def ready():
+        return [n for n in notebooks if n not in status
+                and all(status.get(d) in ['done', 'skipped']
+                        for d in graph[n])]
+
+    def blocked():
+        for n in notebooks:
+            if n not in status and any(status.get(d) in ['failed', 'blocked']
+                                       for d in graph[n]):
+                status[n] = 'blocked'
+                logger.error('`{}` not run, dependencies failed'.format(n))
+
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    futures = {}
+    with pool:
+        while len(status) < len(notebooks):
+            for n in ready():
+                if n in futures.values():
+                    continue
+                nb = notebooks[n]
+                fingerprint = nb.fingerprint()
+                if not (force or rerun & graph[n]) \
+                        and state.get(nb.path) == fingerprint \
+                        and nb.outputs_exist():
+                    status[n] = 'skipped'
+                    logger.info('`{}` is up to date'.format(n))
+                    continue
+                if dry_run:
+                    status[n] = 'done'
+                    rerun.add(n)
+                    logger.info('`{}` would be run'.format(n))
+                    continue
+                logger.info('running `{}`'.format(n))
+                futures[pool.submit(execute, nb.path, timeout,
+                                    executed_dir, force)] = n
+
+            if not futures:
+                blocked()
+                if not ready():
+                    for n in notebooks:
+                        if n not in status:
+                            status[n] = 'blocked'
+                            logger.error('`{}` not run, circular dependency'
+                                         .format(n))
+                continue
+
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                n = futures.pop(f)
+                try:
+                    up_to_date = f.result()
+                except Exception as e:
+                    status[n] = 'failed'
+                    logger.error('`{}` failed: {}'.format(n, e))
+                    state.pop(notebooks[n].path, None)
+                else:
+                    if up_to_date:
+                        status[n] = 'skipped'
+                        logger.info('`{}` is up to date (no changed data)'
+                                    .format(n))
+                    else:
+                        status[n] = 'done'
+                        rerun.add(n)
+                    state[notebooks[n].path] = notebooks[n].fingerprint()
+                _write_state(state)
+            blocked()
+
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('notebooks', nargs='*',
+                        help='notebooks to run (default: all in this folder)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes')
+    parser.add_argument('--force', action='store_true',
+                        help='run all notebooks, even if unchanged '
+                             '(processing all scenarios)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='show the execution plan only')
+    parser.add_argument('--timeout', type=int, default=None,
+                        help='timeout (seconds) for each cell')
+    parser.add_argument('--executed', default=None,
+                        help='folder to save the executed notebooks')
+    parser.add_argument('--excel', action='store_true',
+                        help='write the xlsx workbooks of exported tables')
+    parser.add_argument('--profile', default=None,
+                        help='folder to write a trace of the stages')
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        profiling.enable(args.profile)
+
+    paths = args.notebooks or sorted(glob.glob(os.path.join(HERE, '*.ipynb')))
+    status = run(paths, jobs=args.jobs, force=args.force,
+                 dry_run=args.dry_run, timeout=args.timeout,
+                 executed_dir=args.executed)
+    if args.excel and not args.dry_run:
+        with profiling.stage('write_excel'):
+            for path in export.write_excel(jobs=args.jobs):
+                logger.info('wrote `{}`'.format(path))
+    if args.profile is not None:
+        events = profiling.write_trace(args.profile)
+        logger.info('profile of the run:\n{}'.format(
+            profiling.summary(events).to_string()))
+    if any(s in ['failed', 'blocked'] for s in status.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
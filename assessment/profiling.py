@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of the stages of the IPCC SR15 scenario assessment
+
+A stage is a named block of code, timed by the context manager or decorator
+`stage` (also available as `utils.stage`), e.g.,
+
+    with stage('indicators') as s:
+        ...
+        s.rows = len(data)
+
+    @stage('load_snapshot')
+    def load_snapshot(...):
+
+Each stage records its wall time, the peak resident memory of the process
+and the number of rows processed (set explicitly or taken from the length
+of the result or the first argument), together with the notebook it ran in.
+
+Profiling is disabled unless the environment variable `SR15_PROFILE` is set
+to a folder (see `enable()` or `python pipeline.py --profile FOLDER`);
+the overhead of disabled stages is one lookup of the environment.
+Every process writes its events to one file per notebook in that folder
+(see `set_notebook()`), so that notebooks executed in parallel kernels
+(and figures drawn in worker processes) can be merged by `write_trace()`
+into one trace of the whole pipeline run: `trace.json` and
+`trace.chrome.json` (for `chrome://tracing` or Perfetto).
+"""
+import datetime
+import functools
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROFILE_ENV = 'SR15_PROFILE'
+NOTEBOOK_ENV = 'SR15_NOTEBOOK'
+EVENTS_FILE = '{}.{}.events.json'
+TRACE_FILE = 'trace.json'
+CHROME_TRACE_FILE = 'trace.chrome.json'
+
+# events recorded in this process
+_EVENTS = []
+
+
+def enabled():
+    """Whether profiling is enabled (in this process)"""
+    return bool(os.environ.get(PROFILE_ENV))
+
+
+def enable(folder):
+    """Enable profiling for this process and all processes started from it
+    (e.g., notebook kernels), removing events of earlier runs in `folder`"""
+    folder = os.path.abspath(folder)
+    os.makedirs(folder, exist_ok=True)
+    for f in glob.glob(os.path.join(folder, EVENTS_FILE.format('*', '*'))):
+        os.remove(f)
+    os.environ[PROFILE_ENV] = folder
+    del _EVENTS[:]
+
+
+def set_notebook(name):
+    """Attribute the stages of this process (and of processes started from it)
+    to a notebook
+
+    A process writes its events to one file per notebook, so the events
+    recorded for an earlier notebook (e.g., in a worker process executing
+    several notebooks one after another) are discarded here; they were
+    already written to the file of that notebook.
+    """
+    if os.environ.get(NOTEBOOK_ENV) != name:
+        del _EVENTS[:]
+    os.environ[NOTEBOOK_ENV] = name
+
+
+def _peak_rss():
+    """Peak resident set size of this process (MB)"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def _rows(obj):
+    """Number of rows of a (pandas or pyam) table, or `None`"""
+    obj = getattr(obj, 'data', obj)
+    try:
+        return len(obj) if hasattr(obj, 'shape') else None
+    except TypeError:
+        return None
+
+
+def _flush():
+    """Write the events of this process to the profiling folder"""
+    folder = os.environ[PROFILE_ENV]
+    os.makedirs(folder, exist_ok=True)
+    notebook = os.environ.get(NOTEBOOK_ENV, 'process')
+    path = os.path.join(folder, EVENTS_FILE.format(notebook, os.getpid()))
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump(_EVENTS, f)
+    os.replace(tmp, path)
+
+
+class stage(object):
+    """Record the wall time, peak memory and rows of a stage
+    (context manager or decorator)
+
+    Parameters
+    ----------
+    name : str
+        name of the stage (defaults to the name of a decorated function)
+    rows : int, optional
+        number of rows processed (can also be set in the `with` block)
+    """
+
+    def __init__(self, name=None, rows=None):
+        self.name = name
+        self.rows = rows
+        self._start = None
+
+    def __enter__(self):
+        if enabled():
+            self._start = time.time(), time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._start is None:
+            return False
+        start, t0 = self._start
+        _EVENTS.append({
+            'notebook': os.environ.get(NOTEBOOK_ENV),
+            'stage': self.name,
+            'start': start,
+            'seconds': time.perf_counter() - t0,
+            'peak_rss_mb': _peak_rss(),
+            'rows': self.rows,
+            'failed': exc_type is not None,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        })
+        self._start = None
+        _flush()
+        return False
+
+    def __call__(self, func):
+        name = self.name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            with stage(name, self.rows) as s:
+                ret = func(*args, **kwargs)
+                if s.rows is None:
+                    s.rows = _rows(ret)
+                if s.rows is None and args:
+                    s.rows = _rows(args[0])
+            return ret
+        return wrapper
+
+
+def read_events(folder=None):
+    """Return the events recorded by all processes, ordered by start time"""
+    folder = folder or os.environ[PROFILE_ENV]
+    events = []
+    for f in glob.glob(os.path.join(folder, EVENTS_FILE.format('*', '*'))):
+        with open(f) as stream:
+            events += json.load(stream)
+    return sorted(events, key=lambda e: e['start'])
+
+
+def _chrome_trace(events):
+    """Convert events to the Chrome trace event format"""
+    t0 = min(e['start'] for e in events) if events else 0
+    trace, names = [], {}
+    for e in events:
+        names.setdefault(e['pid'], e['notebook'] or 'process')
+        trace.append({
+            'name': e['stage'], 'cat': e['notebook'] or 'process', 'ph': 'X',
+            'ts': (e['start'] - t0) * 1e6, 'dur': e['seconds'] * 1e6,
+            'pid': e['pid'], 'tid': e['tid'],
+            'args': {k: e[k] for k in ['rows', 'peak_rss_mb', 'failed']},
+        })
+    trace += [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+               'args': {'name': name}} for pid, name in names.items()]
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def write_trace(folder=None):
+    """Merge the events of all processes into `trace.json`
+    and `trace.chrome.json` in the profiling folder
+
+    Returns
+    -------
+    list of dict
+        all events, ordered by start time
+    """
+    folder = folder or os.environ[PROFILE_ENV]
+    events = read_events(folder)
+    trace = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'events': events,
+    }
+    for name, obj in [(TRACE_FILE, trace),
+                      (CHROME_TRACE_FILE, _chrome_trace(events))]:
+        with open(os.path.join(folder, name), 'w') as f:
+            json.dump(obj, f, indent=1)
+    return events
+
+
+def summary(events):
+    """Return the total time, calls, rows and peak memory
+    by notebook and stage as `pandas.DataFrame`"""
+    import pandas as pd
+
+    data = pd.DataFrame(events, columns=['notebook', 'stage', 'seconds',
+                                         'rows', 'peak_rss_mb'])
+    data['notebook'] = data['notebook'].fillna('')
+    return data.groupby(['notebook', 'stage']).agg(
+        calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+        rows=('rows', lambda x: x.sum(min_count=1)),
+        peak_rss_mb=('peak_rss_mb', 'max'),
+    ).sort_values('seconds', ascending=False)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Assignment of projects and scientific references to scenarios
+for the IPCC SR15 scenario assessment
+
+Each row of `bibliography/scenario_references.csv` defines model and/or
+scenario name patterns (with `*` as wildcard, multiple patterns separated by
+`;`) following the syntax of `pyam.IamDataFrame.filter()`. The patterns of all
+rows are compiled once and matched against the unique model and scenario
+names; the project and reference tags of all scenarios are then derived
+from the resulting (rows x scenarios) matrix at once.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+import pyam
+
+logger = pyam.logger()
+
+META_IDX = ['model', 'scenario']
+
+
+def filters(row):
+    """Return the filter arguments (as for `filter()`) of a reference row"""
+    ret = {}
+    for i in META_IDX:
+        if not pd.isnull(row[i]):
+            ret[i] = re.sub(';', '', row[i]).split() if ';' in row[i] \
+                else row[i]
+    return ret
+
+
+def _escape_regexp(s):
+    """Translate a filter pattern to a regular expression
+    (as `pyam.utils.pattern_match()`)"""
+    return (str(s).replace('|', '\\|').replace('.', '\\.')
+            .replace('*', '.*').replace('+', '\\+').replace('(', '\\(')
+            .replace(')', '\\)').replace('$', '\\$')) + '$'
+
+
+def _match(values, names):
+    """Boolean array whether `names` match any of the patterns `values`"""
+    values = values if isinstance(values, list) else [values]
+    pattern = re.compile('|'.join('(?:{})'.format(_escape_regexp(v))
+                                  for v in values))
+    return np.array([pattern.match(n) is not None for n in names], dtype=bool)
+
+
+def match_references(refs, index):
+    """Return the (rows x scenarios) matrix of reference rows
+    matching the scenarios in `index`
+
+    Parameters
+    ----------
+    refs : pandas.DataFrame
+        table of references with columns `model` and `scenario`
+    index : pandas.MultiIndex
+        scenarios (model, scenario), e.g. `IamDataFrame.meta.index`
+    """
+    ret = np.zeros((len(refs), len(index)), dtype=bool)
+    codes = [pd.factorize(index.get_level_values(i)) for i in META_IDX]
+    for k, (_, row) in enumerate(refs.iterrows()):
+        f = filters(row)
+        if not f:
+            continue
+        ret[k] = True
+        for i, (c, names) in zip(META_IDX, codes):
+            if i in f:
+                ret[k] &= _match(f[i], names)[c]
+    return ret
+
+
+def assign_references(refs, index, project='unknown',
+                      reference='undefined'):
+    """Return the project and reference tags of all scenarios
+
+    If several rows match a scenario, the project of the last row is used
+    and the references of all rows are joined (separated by `;`).
+
+    Parameters
+    ----------
+    refs : pandas.DataFrame
+        table of references (`bibliography/scenario_references.csv`)
+    index : pandas.MultiIndex
+        scenarios (model, scenario), e.g. `IamDataFrame.meta.index`
+    project, reference : str
+        default tags for scenarios without match
+
+    Returns
+    -------
+    tuple of (pandas.Series, pandas.Series, pandas.Index)
+        project and reference tags by scenario
+        and the index of rows of `refs` that match any scenario
+    """
+    matches = match_references(refs, index)
+
+    valid = []
+    for k, (i, row) in enumerate(refs.iterrows()):
+        f = filters(row)
+        if not f:
+            logger.warning('project `{}` on line {} has no filters assigned'
+                           .format(row.project, i))
+        elif not matches[k].any():
+            logger.warning('no scenarios satisfy filters for project `{}` '
+                           'on line {} ({})'.format(row.project, i, f))
+        else:
+            valid.append(i)
+
+    has_ref = matches.any(axis=0)
+    last = len(refs) - 1 - matches[::-1].argmax(axis=0)
+    _project = np.where(has_ref, refs['project'].values[last], project)
+
+    rows, cols = np.nonzero(matches.T)
+    joined = pd.Series(refs['reference'].values[cols]).groupby(rows)\
+        .agg('; '.join)
+    _reference = np.full(len(index), reference, dtype=object)
+    _reference[joined.index] = joined.values
+
+    return (pd.Series(_project, index=index, name='project'),
+            pd.Series(_reference, index=index, name='reference'),
+            refs.index[refs.index.isin(valid)])
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Specifications of groupings, markers and plotting styles
+for the notebooks of the IPCC SR15 scenario assessment
+
+The notebook `sr15_2.0_categories_indicators` collects the lists of
+(sub)categories and markers, the default plotting arguments and the
+plotting styles (`run_control`) in a dictionary `specs` and writes it with
+`dump()` to `sr15_specs.yaml` as a plain yaml file, i.e., without python
+object tags, after validating it against the schema below.
+
+The other notebooks read the specifications with `load()`, using the
+C-accelerated safe yaml loader (where available). The validated
+specifications are cached as a json file in the folder `.cache`, keyed
+by a content hash of the yaml file, so that later calls skip parsing
+the yaml file altogether. `apply()` then updates the run control of `pyam`
+with all plotting styles in one call.
+
+Schema:
+
+ - lists of str: `cats`, `all_cats`, `subcats`, `all_subcats`,
+   `cats_15`, `cats_15_no_lo`, `cats_2`, `marker` (and any further
+   groupings given as list of str)
+ - `plotting_args`: mapping of keyword arguments of plotting functions
+ - `run_control`: mapping of a style (`color`, `c`, `marker`,
+   `edgecolors`, `linestyle`) to mappings of a meta column to the style
+   of each value in that column (str or null)
+"""
+import glob
+import io
+import json
+import os
+
+import pyam
+import yaml
+
+from loader import CACHE_FOLDER, HASH_LENGTH, file_hash
+
+LISTS = ['cats', 'all_cats', 'subcats', 'all_subcats', 'cats_15',
+         'cats_15_no_lo', 'cats_2', 'marker']
+STYLES = ['c', 'color', 'edgecolors', 'linestyle', 'marker']
+
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# tag of `pyam.run_control()` objects in specifications written by
+# earlier versions of `sr15_2.0_categories_indicators`
+RUN_CONTROL_TAG = 'tag:yaml.org,2002:python/object:pyam.run_control.RunControl'
+
+
+class _Loader(SafeLoader):
+    """Safe yaml loader reading a tagged run control as plain mapping"""
+
+
+def _construct_run_control(loader, node):
+    return loader.construct_mapping(node, deep=True).get('store', {})
+
+
+_Loader.add_constructor(RUN_CONTROL_TAG, _construct_run_control)
+
+
+def _run_control(run_control):
+    """Return the plotting styles of a run control as plain dictionary
+    (dropping other settings such as `region_mapping`)"""
+    return {key: {col: dict(values) for col, values in styles.items()}
+            for key, styles in run_control.items() if key in STYLES}
+
+
+def validate(specs):
+    """Raise an error if `specs` do not follow the schema (see above)"""
+    def error(msg):
+        raise ValueError('invalid specifications: {}'.format(msg))
+
+    if not isinstance(specs, dict):
+        error('expected a mapping, got {}'.format(type(specs).__name__))
+    for key, value in specs.items():
+        if key in LISTS or isinstance(value, list):
+            if not isinstance(value, list) \
+                    or not all(isinstance(i, str) for i in value):
+                error('`{}` must be a list of str'.format(key))
+        elif key == 'plotting_args':
+            if not isinstance(value, dict):
+                error('`plotting_args` must be a mapping')
+        elif key == 'run_control':
+            for style, columns in value.items():
+                if style not in STYLES:
+                    error('unknown style `{}` in `run_control`'.format(style))
+                for col, values in columns.items():
+                    if not isinstance(values, dict) or not all(
+                            v is None or isinstance(v, str)
+                            for v in values.values()):
+                        error('`run_control[{}][{}]` must map values to str'
+                              .format(style, col))
+        else:
+            error('unknown key `{}`'.format(key))
+
+
+def dump(specs, path):
+    """Validate the specifications and write them as plain yaml file
+
+    Parameters
+    ----------
+    specs : dict
+        specifications, where `run_control` can be a `pyam.run_control()`
+    path : str
+        path of the yaml file, e.g. `sr15_specs.yaml`
+    """
+    specs = dict(specs)
+    if 'run_control' in specs:
+        specs['run_control'] = _run_control(specs['run_control'])
+    validate(specs)
+    with io.open(path, 'w', encoding='utf8') as f:
+        yaml.dump(specs, f, Dumper=SafeDumper, default_flow_style=False,
+                  allow_unicode=True)
+
+
+def _cache_path(path, cache_dir=None):
+    folder, name = os.path.split(os.path.abspath(path))
+    cache_dir = cache_dir or os.path.join(folder, CACHE_FOLDER)
+    return os.path.join(cache_dir, '{}_{}.json'.format(
+        os.path.splitext(name)[0], file_hash(path)[:HASH_LENGTH]))
+
+
+def load(path, cache_dir=None):
+    """Load and validate specifications (via a json cache)
+
+    Parameters
+    ----------
+    path : str
+        path of the yaml file, e.g. `sr15_specs.yaml`
+    cache_dir : str, optional
+        folder for cache files, defaults to `.cache` next to the yaml file
+    """
+    cache = _cache_path(path, cache_dir)
+    if os.path.exists(cache):
+        with open(cache, encoding='utf8') as f:
+            return json.load(f)
+
+    with io.open(path, encoding='utf8') as f:
+        specs = yaml.load(f, Loader=_Loader)
+    if 'run_control' in specs:
+        specs['run_control'] = _run_control(specs['run_control'])
+    validate(specs)
+
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    # remove cache files of previous versions of the same specifications
+    stem = cache.rsplit('_', 1)[0]
+    for f in glob.glob('{}_{}.json'.format(stem, '?' * HASH_LENGTH)):
+        os.remove(f)
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())
+    with open(tmp, 'w', encoding='utf8') as f:
+        json.dump(specs, f)
+    os.replace(tmp, cache)
+    return specs
+
+
+def apply(run_control):
+    """Update the run control of `pyam` with plotting styles in one call
+
+    Parameters
+    ----------
+    run_control : dict
+        the `run_control` of the specifications
+
+    Returns
+    -------
+    pyam.run_control()
+    """
+    rc = pyam.run_control()
+    rc.update(run_control)
+    return rc
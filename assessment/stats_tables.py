@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched descriptive statistics for the summary tables
+of the IPCC SR15 scenario assessment
+
+`Statistics` is a drop-in replacement for `pyam.Statistics`: calls to `add()`
+only register the data, and the statistics of all registered data are computed
+in one pass when the table is reindexed or summarized. The scenarios of
+all data are matched against the meta index once, the groups (`groupby`
+and `filters`, e.g. `('pathways', 'no & lo os 1.5')`) are evaluated once
+on the meta table, and the quantiles of all (group, header, subheader)
+combinations are read off one sorted array.
+
+The resulting table (and its summary) has the same layout
+as the table compiled by `pyam.Statistics`.
+"""
+import numpy as np
+import pandas as pd
+import pyam
+from pyam.utils import pattern_match
+
+from profiling import stage
+
+META_IDX = ['model', 'scenario']
+
+
+def _lerp(a, b, t):
+    """Linear interpolation as in `numpy.percentile()`"""
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def describe(key, values, n, percentiles=[0.25, 0.5, 0.75]):
+    """Return the statistics of `pandas.describe()` for grouped values
+
+    Parameters
+    ----------
+    key : numpy.ndarray
+        group (in `range(n)`) of each value
+    values : numpy.ndarray
+        values (nan is ignored)
+    n : int
+        number of groups
+    percentiles : list of float
+        percentiles to be computed
+
+    Returns
+    -------
+    numpy.ndarray
+        array of shape (n, 5 + len(percentiles)) with the count, mean, std,
+        min, percentiles and max of each group
+    """
+    valid = ~np.isnan(values)
+    key, x = key[valid], values[valid]
+    order = np.lexsort((x, key))
+    key, x = key[order], x[order]
+
+    count = np.bincount(key, minlength=n)
+    start = np.cumsum(count) - count
+    x = np.append(x, np.nan)  # dummy element for empty groups
+
+    def element(k):
+        return x[np.where(count > 0, start + k, len(x) - 1)]
+
+    def quantile(p):
+        pos = (np.maximum(count, 1) - 1) * p
+        lo = np.floor(pos).astype(int)
+        hi = np.ceil(pos).astype(int)
+        return _lerp(element(lo), element(hi), pos - lo)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(key, weights=x[:-1], minlength=n) / count
+        sq = np.bincount(key, weights=(x[:-1] - mean[key]) ** 2, minlength=n)
+        std = np.sqrt(sq / (count - 1))
+    std[count < 2] = np.nan
+
+    return np.column_stack(
+        [count, mean, std, element(0)]
+        + [quantile(p) for p in percentiles]
+        + [element(np.maximum(count, 1) - 1)])
+
+
+def _scenarios(data):
+    """Return the (model, scenario) index of the rows of `data`"""
+    if set(META_IDX).issubset(data.index.names):
+        return pd.MultiIndex.from_arrays(
+            [data.index.get_level_values(i) for i in META_IDX])
+    if set(META_IDX).issubset(data.columns):
+        return pd.MultiIndex.from_arrays([data[i] for i in META_IDX])
+    raise ValueError('missing required index dimensions or columns!')
+
+
+class Statistics(pyam.Statistics):
+    """Descriptive statistics of IAMC-style timeseries data
+    (batched version of `pyam.Statistics`, see there for the parameters)"""
+
+    def __init__(self, df, groupby=None, filters=None, rows=False,
+                 percentiles=[0.25, 0.5, 0.75]):
+        super(Statistics, self).__init__(df, groupby=groupby, filters=filters,
+                                         rows=rows, percentiles=percentiles)
+        self._specs = []
+
+    def add(self, data, header, row=None, subheader=None):
+        """Register `data` to be described (filtered by the arguments
+        of this instance) in the columns `header` and `subheader`
+
+        Parameters
+        ----------
+        data : pd.DataFrame or pd.Series
+            data for which summary statistics should be computed
+        header : str
+            column name for descriptive statistics
+        row : str
+            row name for descriptive statistics
+            (required if `Statistics(rows=True)`)
+        subheader : str, optional
+            column name (level=1) if data is a unnamed `pd.Series`
+        """
+        if self.rows is not None and row is None:
+            raise ValueError('row specification required')
+        if self.rows is None and row is not None:
+            raise ValueError('row arg illegal for this `Statistics` instance')
+        if isinstance(data, pd.Series):
+            if subheader is not None:
+                data = data.rename(subheader)
+            elif data.name is None:
+                msg = '`data` must be named `pd.Series` or provide `subheader`'
+                raise ValueError(msg)
+            data = pd.DataFrame(data)
+        data = data.select_dtypes(include=[np.number])
+
+        if self.rows is not None and row not in self.rows:
+            self.rows.append(row)
+        self._add_to_header(header, data.columns.unique())
+        self._specs.append((header, row, data))
+
+    def add_many(self, specs):
+        """Register several data at once
+
+        Parameters
+        ----------
+        specs : list of tuples
+            `(header, subheader, data)` or `(header, subheader, data, row)`,
+            see `add()`
+        """
+        for spec in specs:
+            header, subheader, data = spec[:3]
+            row = spec[3] if len(spec) > 3 else None
+            self.add(data, header, row=row, subheader=subheader)
+
+    def _groups(self):
+        """Return the index and members of all groups
+
+        Members are given as boolean array over the scenarios of the meta
+        index, with a last element for scenarios not in the meta index
+        (only included by filters without arguments).
+        """
+        meta = self.df.meta
+        groups = []
+
+        if self.groupby is not None:
+            col, values = self.col, self.groupby[self.col]
+            keep = ~pd.isnull(meta[col]).values
+            if values is not None:
+                keep &= np.asarray(pattern_match(meta[col], values))
+            for v in sorted(meta[col][keep].unique()):
+                members = np.append(keep & (meta[col] == v).values, False)
+                groups.append(((col, v), members, False))
+
+        for (idx, _filter) in self.filters:
+            keep = np.ones(len(meta), dtype=bool)
+            for col, values in _filter.items():
+                if col in META_IDX and values is not None:
+                    keep &= np.asarray(pattern_match(
+                        meta.index.get_level_values(col), values,
+                        has_nan=False))
+                elif values is not None:
+                    keep &= np.asarray(pattern_match(meta[col], values))
+            apply_filter = any(v is not None for v in _filter.values())
+            idx = idx if isinstance(idx, tuple) else (idx,)
+            groups.append((idx, np.append(keep, not apply_filter), True))
+
+        return groups
+
+    @stage('Statistics.compute')
+    def compute(self):
+        """Compute the statistics of all registered data in one pass"""
+        if not self._specs:
+            return
+
+        groups = self._groups()
+        members = np.column_stack([g[1] for g in groups])
+
+        # (spec, subheader) keys and scenario codes of all values
+        keys, codes, values, spec_of_key = [], [], [], []
+        scenarios = [_scenarios(data) for _, _, data in self._specs]
+        positions = self.df.meta.index.get_indexer(
+            scenarios[0].append(scenarios[1:]) if len(scenarios) > 1
+            else scenarios[0])
+        offset = 0
+        for s, (header, row, data) in enumerate(self._specs):
+            n, m = data.shape
+            pos = positions[offset:offset + n]
+            offset += n
+            codes.append(np.repeat(pos, m))
+            keys.append(np.tile(np.arange(m), n) + len(spec_of_key))
+            values.append(np.asarray(data.values, dtype=float).ravel())
+            spec_of_key += [(s, c) for c in data.columns]
+
+        codes, keys = np.concatenate(codes), np.concatenate(keys)
+        values = np.concatenate(values)
+        n_keys, n_groups = len(spec_of_key), len(groups)
+
+        # expand values to all groups that include the respective scenario
+        i, g = np.nonzero(members[codes])
+        cell = g * n_keys + keys[i]
+        stats = describe(cell, values[i], n_keys * n_groups, self.percentiles)
+
+        # groups of `groupby` are only shown for data with rows in this group
+        spec = np.array([s for s, _ in spec_of_key], dtype=int)
+        present = np.zeros((n_groups, len(self._specs)), dtype=bool)
+        present[g, spec[keys[i]]] = True
+
+        rows, cols, order = [], [], []
+        for _g, (idx, _, is_filter) in enumerate(groups):
+            for k, (s, subheader) in enumerate(spec_of_key):
+                if not (is_filter or present[_g, s]):
+                    continue
+                header, row, _ = self._specs[s]
+                rows.append(idx + ((row, ) if self.rows is not None else ()))
+                cols.append((header, subheader))
+                order.append(_g * n_keys + k)
+
+        # the last non-nan value of each cell is used (as `combine_first()`)
+        _stats = pd.DataFrame(stats[order], columns=self._describe_cols)
+        _stats['row'], row_index = pd.factorize(pd.Series(rows))
+        _stats['col'], col_index = pd.factorize(pd.Series(cols))
+        _stats = (
+            _stats.groupby(['row', 'col'], sort=False).last()
+            .unstack('col').swaplevel(0, 1, axis=1)
+        )
+        _stats.index = pd.MultiIndex.from_tuples(row_index[_stats.index])
+        _stats.columns = pd.MultiIndex.from_tuples(
+            [col_index[c] + (d, ) for c, d in _stats.columns],
+            names=['', None, None])
+
+        self.stats = _stats if self.stats is None \
+            else _stats.combine_first(self.stats)
+        self._specs = []
+
+    def reindex(self, copy=True):
+        """Reindex the summary statistics dataframe"""
+        self.compute()
+        return super(Statistics, self).reindex(copy=copy)
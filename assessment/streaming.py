@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming ingest of large IAMC-format snapshots into a memory-mapped store
+
+The regional (R5) and native-region releases of the scenario ensemble are
+too large to be parsed into a `pyam.IamDataFrame` at once. `ingest()` reads
+the wide IAMC-format file (`csv` or `xlsx`) in chunks of rows and appends
+them to a store on disk: the model, scenario, region, variable and unit
+of each timeseries as integer codes, and the values as a dense float array
+over all years of the file.
+
+`Store` opens these arrays as read-only memory maps. Filters are evaluated on
+the (small) tables of names once and then applied to the codes chunk by chunk;
+`timeseries()` yields the selected timeseries as wide tables and `apply()`
+computes an indicator (e.g., `indicators.cumulative`) chunk by chunk,
+so that the peak memory is bounded by the chunk size
+regardless of the size of the ensemble.
+"""
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyam
+from pyam.utils import pattern_match
+
+from loader import HASH_LENGTH, cache_path
+
+logger = pyam.logger()
+
+IAMC_IDX = ['model', 'scenario', 'region', 'variable', 'unit']
+CHUNKSIZE = 100000
+META_FILE = 'store.json'
+CODES_FILE = 'codes.int32'
+VALUES_FILE = 'values.float64'
+
+
+def _year(col):
+    """Return a column name as year (int) or `None` if it is no year"""
+    try:
+        return int(col)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_chunks(path, chunksize=CHUNKSIZE, sheet_name=None):
+    """Yield chunks of rows of a wide IAMC-format file as `pandas.DataFrame`
+
+    Parameters
+    ----------
+    path : str
+        IAMC-format file (`csv` or `xlsx`)
+    chunksize : int
+        number of rows (timeseries) per chunk
+    sheet_name : str, optional
+        worksheet of an `xlsx` file, defaults to the first worksheet
+    """
+    if not path.endswith('.xlsx'):
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield chunk
+        return
+
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = list(next(rows))
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) == chunksize:
+                yield pd.DataFrame(buffer, columns=header)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header)
+    finally:
+        wb.close()
+
+
+def _write_json(obj, path):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def ingest(path, store, chunksize=CHUNKSIZE, sheet_name=None):
+    """Convert an IAMC-format file to a memory-mapped store chunk by chunk
+
+    Parameters
+    ----------
+    path : str
+        IAMC-format file (`csv` or `xlsx`)
+    store : str
+        folder of the store (created or overwritten)
+    chunksize : int
+        number of rows (timeseries) per chunk
+    sheet_name : str, optional
+        worksheet of an `xlsx` file, defaults to the first worksheet
+
+    Returns
+    -------
+    Store
+    """
+    tmp = '{}.{}.tmp'.format(store.rstrip(os.sep), os.getpid())
+    os.makedirs(tmp)
+    labels = {i: {} for i in IAMC_IDX}
+    columns, years, n = None, None, 0
+
+    with open(os.path.join(tmp, CODES_FILE), 'wb') as f_codes, \
+            open(os.path.join(tmp, VALUES_FILE), 'wb') as f_values:
+        for chunk in read_chunks(path, chunksize, sheet_name):
+            if columns is None:
+                names = {c: str(c).lower() for c in chunk.columns}
+                columns = [c for c in chunk.columns if names[c] in IAMC_IDX]
+                missing = set(IAMC_IDX) - {names[c] for c in columns}
+                if missing:
+                    raise ValueError('missing required columns `{}` in `{}`'
+                                     .format(sorted(missing), path))
+                year_cols = [c for c in chunk.columns
+                             if _year(c) is not None]
+                years = [_year(c) for c in year_cols]
+
+            codes = np.empty((len(chunk), len(IAMC_IDX)), dtype=np.int32)
+            for k, c in enumerate(columns):
+                mapping = labels[names[c]]
+                for value in pd.unique(chunk[c]):
+                    mapping.setdefault(value, len(mapping))
+                codes[:, k] = chunk[c].map(mapping).values
+            codes.tofile(f_codes)
+            chunk[year_cols].apply(pd.to_numeric, errors='coerce')\
+                .values.astype(np.float64).tofile(f_values)
+            n += len(chunk)
+            logger.info('ingested {} timeseries from `{}`'.format(n, path))
+
+    _write_json({'rows': n, 'years': years,
+                 'labels': {i: list(labels[i]) for i in IAMC_IDX}},
+                os.path.join(tmp, META_FILE))
+    if os.path.exists(store):
+        shutil.rmtree(store)
+    os.replace(tmp, store)
+    return Store(store)
+
+
+def store_path(path, cache_dir=None):
+    """Return the path of the store for a snapshot file
+    (next to the cache file of `loader.load_snapshot()`)"""
+    return '{}.store'.format(os.path.splitext(cache_path(path, cache_dir))[0])
+
+
+def open_store(path, cache_dir=None, chunksize=CHUNKSIZE, sheet_name=None):
+    """Open the memory-mapped store of a snapshot, ingesting it if necessary
+
+    The store is keyed by a content hash of the source file (as the cache
+    of `loader.load_snapshot()`), stores of previous versions are removed.
+    """
+    store = store_path(path, cache_dir)
+    if os.path.exists(os.path.join(store, META_FILE)):
+        return Store(store)
+
+    stem = store.rsplit('_', 1)[0]
+    for f in glob.glob('{}_{}.store'.format(stem, '?' * HASH_LENGTH)):
+        shutil.rmtree(f)
+    os.makedirs(os.path.dirname(store), exist_ok=True)
+    return ingest(path, store, chunksize, sheet_name)
+
+
+class Store(object):
+    """Memory-mapped timeseries data written by `ingest()`
+
+    Parameters
+    ----------
+    path : str
+        folder of the store
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        n = meta['rows']
+        self.path = path
+        self.years = np.array(meta['years'], dtype=int)
+        self.labels = {i: pd.Index(meta['labels'][i], dtype=object)
+                       for i in IAMC_IDX}
+        self.codes = np.memmap(os.path.join(path, CODES_FILE),
+                               dtype=np.int32, mode='r',
+                               shape=(n, len(IAMC_IDX)))
+        self.values = np.memmap(os.path.join(path, VALUES_FILE),
+                                dtype=np.float64, mode='r',
+                                shape=(n, len(self.years)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _lookup(self, filters):
+        """Return boolean arrays (by code) of names matching the filters"""
+        lookup = {}
+        for col, values in filters.items():
+            if col not in IAMC_IDX:
+                raise ValueError('filter by `{}` not supported'.format(col))
+            lookup[IAMC_IDX.index(col)] = np.asarray(
+                pattern_match(pd.Series(self.labels[col]), values))
+        return lookup
+
+    def _chunks(self, chunksize, filters):
+        """Yield the index of the selected rows, chunk by chunk"""
+        lookup = self._lookup(filters)
+        for start in range(0, len(self), chunksize):
+            codes = self.codes[start:start + chunksize]
+            keep = np.ones(len(codes), dtype=bool)
+            for k, match in lookup.items():
+                keep &= match[codes[:, k]]
+            rows = start + np.flatnonzero(keep)
+            if len(rows):
+                yield rows
+
+    def _frame(self, rows, cols):
+        """Return selected rows as wide timeseries table"""
+        codes = np.asarray(self.codes[rows])
+        index = pd.MultiIndex(levels=[self.labels[i] for i in IAMC_IDX],
+                              codes=codes.T, names=IAMC_IDX,
+                              verify_integrity=False)
+        return pd.DataFrame(self.values[rows][:, cols], index=index,
+                            columns=pd.Index(self.years[cols], name='year'))
+
+    def _columns(self, year):
+        if year is None:
+            return np.arange(len(self.years))
+        return np.flatnonzero(np.isin(self.years, year))
+
+    def timeseries(self, chunksize=CHUNKSIZE, year=None, **filters):
+        """Yield the selected timeseries in wide format, chunk by chunk
+
+        Parameters
+        ----------
+        chunksize : int
+            number of rows of the store scanned per chunk
+        year : int or list of int, optional
+            years to be included (default: all)
+        filters
+            filters by `model`, `scenario`, `region`, `variable` or `unit`
+            (with `*` as wildcard, as `pyam.IamDataFrame.filter()`)
+        """
+        cols = self._columns(year)
+        for rows in self._chunks(chunksize, filters):
+            yield self._frame(rows, cols)
+
+    def reported_years(self, chunksize=CHUNKSIZE, year=None, **filters):
+        """Return the years with any value in the selected timeseries"""
+        cols = self._columns(year)
+        reported = np.zeros(len(cols), dtype=bool)
+        for rows in self._chunks(chunksize, filters):
+            reported |= ~np.isnan(self.values[rows][:, cols]).all(axis=0)
+        return self.years[cols][reported]
+
+    def filter(self, chunksize=CHUNKSIZE, year=None, **filters):
+        """Return the selected timeseries as one wide table
+        (as `pyam.IamDataFrame.filter(...).timeseries()`)"""
+        year = self.reported_years(chunksize, year, **filters)
+        chunks = list(self.timeseries(chunksize, year, **filters))
+        if not chunks:
+            return self._frame(np.array([], dtype=int), self._columns(year))
+        return pd.concat(chunks).sort_index()
+
+    def apply(self, func, chunksize=CHUNKSIZE, year=None, filters=None,
+              **kwargs):
+        """Apply a function to the selected timeseries chunk by chunk
+
+        The timeseries tables passed to `func` have the same columns
+        (the years reported in any selected timeseries) for all chunks,
+        so that the results are identical to applying `func` to the table
+        returned by `filter()`.
+
+        Parameters
+        ----------
+        func : function
+            function of a wide timeseries table, e.g. `indicators.cumulative`
+        chunksize : int
+            number of rows of the store scanned per chunk
+        year : int or list of int, optional
+            years to be included (default: all)
+        filters : dict, optional
+            filters by `model`, `scenario`, `region`, `variable` or `unit`
+        kwargs
+            passed to `func`
+        """
+        filters = filters or {}
+        year = self.reported_years(chunksize, year, **filters)
+        ret = [func(data, **kwargs)
+               for data in self.timeseries(chunksize, year, **filters)]
+        return pd.concat(ret).sort_index() if ret else pd.Series()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Array-backed (scenario x variable x year) representation of a scenario ensemble
+
+The timeseries data in long IAMC format are converted once to a compact
+container: the model, scenario, region, variable and unit names are stored
+as integer codes, and the values of each timeseries (a reported combination
+of model, scenario, region and variable) as one row of a dense array over
+all years, with a bitmask of the reported years. Only reported timeseries
+are stored, so the tensor is sparse in the (scenario x variable) dimensions.
+
+The rows are sorted by variable, so that the timeseries of a variable are
+a contiguous block: slicing by variable takes constant time and returns
+views of the underlying arrays, which can be passed to the functions
+in `indicators.py` (via `timeseries()`) without copying the data.
+"""
+import numpy as np
+import pandas as pd
+import pyam
+
+IAMC_IDX = ['model', 'scenario', 'region', 'variable', 'unit']
+CODES = ['model', 'scenario', 'region', 'unit']
+
+
+class Tensor(object):
+    """Timeseries data of a scenario ensemble as arrays
+
+    Use `Tensor.from_data()` to build an instance from long-format data.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        values of shape (timeseries, years), nan where not reported
+    valid : numpy.ndarray
+        bitmask of reported years (packed along the year axis)
+    codes : dict of numpy.ndarray
+        codes of the model, scenario, region and unit of each timeseries
+    labels : dict of pandas.Index
+        names of the models, scenarios, regions, variables and units
+    offsets : numpy.ndarray
+        first timeseries of each variable (and total number of timeseries)
+    years : numpy.ndarray
+        years of the columns of `values`
+    """
+
+    def __init__(self, values, valid, codes, labels, offsets, years):
+        self.values = values
+        self.valid = valid
+        self.codes = codes
+        self.labels = labels
+        self.offsets = offsets
+        self.years = years
+        self._variables = pd.Index(labels['variable'])
+
+    @classmethod
+    def from_data(cls, data, dtype=np.float32):
+        """Build the tensor from timeseries data in long IAMC format
+
+        Parameters
+        ----------
+        data : pandas.DataFrame or pyam.IamDataFrame
+            data with columns `model`, `scenario`, `region`, `variable`,
+            `unit`, `year` and `value`
+        dtype : numpy dtype, default float32
+            dtype of the values
+        """
+        data = data.data if isinstance(data, pyam.IamDataFrame) else data
+        codes, labels = {}, {}
+        for i in IAMC_IDX + ['year']:
+            codes[i], labels[i] = pd.factorize(data[i], sort=True)
+        years = np.asarray(labels.pop('year'), dtype=int)
+        year = codes.pop('year')
+
+        # one timeseries per (variable, model, scenario, region), sorted
+        key = np.zeros(len(data), dtype=np.int64)
+        for i in ['variable', 'model', 'scenario', 'region']:
+            key = key * len(labels[i]) + codes[i]
+        key, first, series = np.unique(key, return_index=True,
+                                       return_inverse=True)
+        series = series.ravel()
+
+        values = np.full((len(key), len(years)), np.nan, dtype=dtype)
+        values[series, year] = data['value'].values
+        mask = np.zeros(values.shape, dtype=bool)
+        mask[series, year] = True
+
+        variable = codes['variable'][first]
+        offsets = np.searchsorted(variable, np.arange(len(labels['variable'])
+                                                      + 1))
+        return cls(values, np.packbits(mask, axis=1),
+                   {i: codes[i][first] for i in CODES},
+                   labels, offsets, years)
+
+    @property
+    def variables(self):
+        return self._variables
+
+    def __len__(self):
+        return len(self.values)
+
+    def rows(self, variable):
+        """Return the (contiguous) rows of the timeseries of a variable"""
+        k = self._variables.get_loc(variable)
+        return slice(self.offsets[k], self.offsets[k + 1])
+
+    def view(self, variable):
+        """Return the values of a variable (a view without copy)"""
+        return self.values[self.rows(variable)]
+
+    def mask(self, variable):
+        """Return the boolean mask of reported years of a variable"""
+        return np.unpackbits(self.valid[self.rows(variable)], axis=1,
+                             count=len(self.years)).astype(bool)
+
+    def index(self, variable, units=None):
+        """Return the IAMC index (as `timeseries()`) of a variable
+
+        `units` optionally replaces the names of the units
+        (a list aligned with `labels['unit']`).
+        """
+        rows = self.rows(variable)
+        unit_codes, unit_labels = self.codes['unit'][rows], self.labels['unit']
+        if units is not None:
+            recode, unit_labels = pd.factorize(pd.Index(units))
+            unit_codes = recode[unit_codes]
+        levels = [self.labels[i] for i in CODES[:3]] + [[variable],
+                                                       unit_labels]
+        codes = [self.codes[i][rows] for i in CODES[:3]] \
+            + [np.zeros(len(unit_codes), dtype=int), unit_codes]
+        return pd.MultiIndex(levels=levels, codes=codes, names=IAMC_IDX,
+                             verify_integrity=False)
+
+    def timeseries(self, variable, conversion=None):
+        """Return the timeseries of a variable in wide format
+        (as `pyam.IamDataFrame.filter(variable=...).timeseries()`)
+
+        Parameters
+        ----------
+        variable : str
+            name of the variable
+        conversion : dict, optional
+            unit conversion as for `pyam.IamDataFrame.convert_unit()`,
+            `{current: (target, factor)}`
+
+        Returns
+        -------
+        pandas.DataFrame
+            the values are a view of the tensor if no conversion is applied
+            and the reported years are equally spaced
+        """
+        values = self.view(variable)
+        units = None
+        if conversion:
+            units = list(self.labels['unit'])
+            factor = np.ones(len(units), dtype=values.dtype)
+            for current, (target, f) in conversion.items():
+                if current in units:
+                    k = units.index(current)
+                    units[k], factor[k] = target, f
+            unit = self.codes['unit'][self.rows(variable)]
+            values = values * factor[unit, np.newaxis]
+
+        # only years reported for this variable (as `timeseries()`),
+        # selected by a (strided) slice if possible to return a view
+        k = np.flatnonzero(self.mask(variable).any(axis=0))
+        step = k[1] - k[0] if len(k) > 1 else 1
+        cols = slice(k[0], k[-1] + 1, step) if len(k) \
+            and np.all(np.diff(k) == step) else k
+        values, years = values[:, cols], self.years[cols]
+
+        return pd.DataFrame(values, index=self.index(variable, units),
+                            columns=pd.Index(years, name='year'), copy=False)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the vectorized indicators (module `indicators`)
+
+The indicators of the notebook `sr15_2.0_categories_indicators` were
+originally computed by row-wise functions applied to each scenario.
+These functions are kept below as reference implementations, and the tests
+verify that the vectorized indicators are identical (bit-for-bit) to them
+on synthetic ensembles (see `benchmark.synthetic_ensemble()`).
+
+Usage (from the `assessment` folder):
+
+    python -m pytest test_indicators.py
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import pyam
+import pytest
+
+import benchmark
+import indicators
+
+THRESHOLDS = [1.5, 2.0]
+NPV = {'r': 0.05, 'discount_year': 2020, 'first_year': 2030, 'last_year': 2100}
+
+
+# row-wise reference implementations
+
+def peak_warming(x, return_year=False):
+    peak = x[x == x.max()]
+    if return_year:
+        return peak.index[0]
+    else:
+        return float(max(peak))
+
+
+def exceedance(temperature, years, threshold):
+    exceedance_yr = None
+    return_yr = None
+    overshoot_yr_count = None
+    prev_temp = 0
+    prev_yr = None
+
+    for yr, curr_temp in zip(years, temperature):
+        if np.isnan(curr_temp):
+            continue
+
+        if exceedance_yr is None and curr_temp > threshold:
+            x = (curr_temp - prev_temp) / (yr - prev_yr)  # temperature change per year
+            exceedance_yr = prev_yr + int((threshold - prev_temp) / x) + 1  # add one because int() rounds down
+        if exceedance_yr is not None and return_yr is None and curr_temp < threshold:
+            x = (prev_temp - curr_temp) / (yr - prev_yr)  # temperature change per year
+            return_yr = prev_yr + int((prev_temp - threshold) / x) + 1
+        prev_temp = curr_temp
+        prev_yr = yr
+
+    if return_yr is not None and exceedance_yr is not None:
+        overshoot_yr_count = int(return_yr - exceedance_yr)
+    if exceedance_yr is not None:
+        exceedance_yr = int(exceedance_yr)
+    if return_yr is not None:
+        return_yr = int(return_yr)
+
+    return [exceedance_yr, return_yr, overshoot_yr_count]
+
+
+def overshoot_severity(x, meta, threshold):
+    exceedance_yr = meta.loc[x.name[0:2]]['exceedance year|{}°C'.format(threshold)]
+    return_yr = meta.loc[x.name[0:2]]['return year|{}°C'.format(threshold)] - 1
+    # do not include year in which mean temperature returns to below threshold
+    if exceedance_yr > 0 and return_yr > 0:
+        return pyam.cumulative(x.copy(), exceedance_yr, return_yr) \
+            - (return_yr - exceedance_yr + 1) * threshold
+
+
+def year_of_net_zero(data, years, threshold):
+    prev_val = 0
+    prev_yr = np.nan
+
+    for yr, val in zip(years, data):
+        if np.isnan(val):
+            continue
+
+        if val < threshold:
+            x = (val - prev_val) / (yr - prev_yr)  # absolute change per year
+            return prev_yr + int((threshold - prev_val) / x) + 1  # add one because int() rounds down
+
+        prev_val = val
+        prev_yr = yr
+    return np.inf
+
+
+def get_from_meta_column(meta, x, col):
+    val = meta.loc[x.name[0:2], col]
+    return val if val < np.inf else max(x.index)
+
+
+def compute_w1_annual(r, dt):
+    value = 0
+    for i in range(1, dt):  # range does not include the last element, but this is 0 in this formula
+        value += math.pow(1 / (1 + r), i) * (1 - i / dt)
+    return value
+
+
+def compute_w2_annual(r, dt):
+    value = 0
+    for i in range(1, dt + 1):  # range does not include the last element
+        value += math.pow(1 / (1 + r), i - dt) * (i / dt)
+    return value
+
+
+def compute_w1_compounded(r, dt):
+    return 1 / r - (1 - math.exp(-r * dt)) / (r * r * dt)
+
+
+def compute_w2_compounded(r, dt):
+    return - 1 / r + (math.exp(r * dt) - 1) / (r * r * dt)
+
+
+# this function is an adaptation of 'pyam.timeseries:cumulative()'
+def npv_weighted(x, first_year, last_year, w1, w2, w1_function, w2_function, r):
+    if min(x.index) > first_year or max(x.index) < last_year:
+        return np.nan
+
+    x = x.copy()
+    x[first_year] = pyam.fill_series(x, first_year)
+    x[last_year] = pyam.fill_series(x, last_year)
+
+    years = [i for i in x.index if i >= first_year and i <= last_year
+             and ~np.isnan(x[i])]
+    years.sort()
+
+    # loop over years
+    if not np.isnan(x[first_year]) and not np.isnan(x[last_year]):
+        value = 0
+        for (i, yr) in enumerate(years[:-1]):
+            next_yr = years[i + 1]
+            dt = next_yr - yr
+            if dt not in w1.keys():
+                w1[dt] = w1_function(r, dt)
+            if dt not in w2.keys():
+                w2[dt] = w2_function(r, dt)
+            # the summation is shifted to include the first year fully in sum,
+            # otherwise, would return a weighted average of `yr` and `next_yr`
+            value += w1[dt] * x[yr] + w2[dt] * x[next_yr]
+
+        # the loop above does not include the last element in range `last_year`,
+        # therefore added explicitly
+        value += x[last_year]
+
+        return value / (last_year - first_year + 1)
+
+
+# tests
+
+def assert_identical(reference, vectorized):
+    np.testing.assert_array_equal(
+        pd.to_numeric(reference).values.astype(float),
+        np.asarray(vectorized, dtype=float))
+
+
+def aligned(meta, data):
+    """Return the rows of `meta` in the order of the rows of `data`"""
+    return meta.reindex(pd.MultiIndex.from_arrays(
+        [data.index.get_level_values(i) for i in indicators.META_IDX]))
+
+
+@pytest.fixture(scope='module')
+def ensemble():
+    return benchmark.synthetic_ensemble(scale=0.5, variables=1, seed=1)
+
+
+@pytest.fixture(scope='module')
+def temperature(ensemble):
+    return ensemble['data'][benchmark.TEMPERATURE]
+
+
+@pytest.fixture(scope='module')
+def co2(ensemble):
+    return ensemble['data'][benchmark.CO2] / 1000
+
+
+@pytest.fixture(scope='module')
+def carbon_price_npv(ensemble):
+    data = ensemble['data']['Variable|0'].copy()
+    for y in data.columns:
+        data[y] = data[y] / math.pow(1 + NPV['r'], y - NPV['discount_year'])
+    return data
+
+
+@pytest.fixture(scope='module')
+def meta(temperature, co2):
+    """Reference exceedance, peak and net-zero years by model and scenario"""
+    ret = {}
+    for t in THRESHOLDS:
+        ex = temperature.apply(exceedance, axis=1, result_type='reduce',
+                               years=temperature.columns, threshold=t)
+        for i, col in enumerate(indicators.EXCEEDANCE_COLS):
+            ret['{}|{}°C'.format(col, t)] = pd.to_numeric(ex.apply(lambda x: x[i]))
+    ret['year of peak warming'] = temperature.apply(
+        peak_warming, return_year=True, axis=1)
+    ret['year of netzero'] = co2.apply(
+        year_of_net_zero, years=co2.columns, threshold=0, axis=1)
+    ret = [pd.Series(v, name=k).reset_index(['region', 'variable', 'unit'],
+                                            drop=True)
+           for k, v in ret.items()]
+    return pd.concat(ret, axis=1)
+
+
+def test_peak_warming(temperature):
+    obs = indicators.peak_warming(temperature)
+    assert_identical(temperature.apply(peak_warming, axis=1), obs['value'])
+    assert_identical(temperature.apply(peak_warming, return_year=True, axis=1),
+                     obs['year'])
+
+
+@pytest.mark.parametrize('threshold', THRESHOLDS)
+def test_exceedance(temperature, meta, threshold):
+    obs = indicators.exceedance(temperature, threshold)
+    meta = aligned(meta, temperature)
+    for col in indicators.EXCEEDANCE_COLS:
+        name = '{}|{}°C'.format(col, threshold)
+        assert_identical(meta[name], obs[col])
+
+
+def test_warming_indicators(temperature, meta):
+    obs = indicators.warming_indicators(temperature, THRESHOLDS)
+    for t in THRESHOLDS:
+        for col in indicators.EXCEEDANCE_COLS:
+            name = '{}|{}°C'.format(col, t)
+            assert_identical(aligned(meta, temperature)[name], obs[name])
+        name = 'exceedance severity|{}°C'.format(t)
+        exp = temperature.apply(overshoot_severity, axis=1, meta=meta,
+                                threshold=t)
+        assert_identical(exp, obs[name])
+
+
+def test_year_of_net_zero(co2, meta):
+    assert_identical(aligned(meta, co2)['year of netzero'],
+                     indicators.year_of_net_zero(co2, threshold=0))
+
+
+@pytest.mark.parametrize('first_year, last_year', [(2016, 2100),
+                                                   (2010, 2050),
+                                                   (2030, 2100)])
+def test_cumulative(co2, carbon_price_npv, first_year, last_year):
+    for data in [co2, carbon_price_npv]:
+        exp = data.apply(lambda x: pyam.cumulative(x.copy(), first_year,
+                                                   last_year), axis=1)
+        assert_identical(exp, indicators.cumulative(data, first_year,
+                                                    last_year))
+
+
+@pytest.mark.parametrize('col', ['year of peak warming', 'year of netzero'])
+def test_cumulative_to_meta_year(co2, meta, col):
+    exp = co2.apply(lambda x: pyam.cumulative(
+        x.copy(), 2016, get_from_meta_column(meta, x, col)), axis=1)
+    last_year = indicators.year_from_meta(co2, meta[col])
+    assert_identical(exp, indicators.cumulative(co2, 2016, last_year))
+
+
+def test_value_in_year_of_net_zero(temperature, meta):
+    exp = temperature.apply(
+        lambda x: x[get_from_meta_column(meta, x, 'year of netzero')], axis=1)
+    year = indicators.year_from_meta(temperature, meta['year of netzero'])
+    assert_identical(exp, indicators.value_in_year(temperature, year))
+
+
+@pytest.mark.parametrize('w1_function, w2_function', [
+    (compute_w1_annual, compute_w2_annual),
+    (compute_w1_compounded, compute_w2_compounded),
+])
+def test_npv_weighted(carbon_price_npv, w1_function, w2_function):
+    first_year, last_year, r = NPV['first_year'], NPV['last_year'], NPV['r']
+    exp = carbon_price_npv.apply(
+        npv_weighted, first_year=first_year, last_year=last_year,
+        w1={}, w2={}, w1_function=w1_function, w2_function=w2_function,
+        r=r, axis=1)
+    obs = indicators.npv_weighted(carbon_price_npv, first_year, last_year,
+                                  w1_function, w2_function, r)
+    assert_identical(exp, obs)
+
+
+@pytest.mark.parametrize('data', ['co2', 'carbon_price_npv'])
+def test_annual(request, data):
+    data = request.getfixturevalue(data)
+    obs = indicators.annual(data)
+    exp = data.apply(lambda x: pd.Series(
+        [pyam.fill_series(x.copy(), y) for y in obs.columns],
+        index=obs.columns), axis=1)
+    np.testing.assert_array_equal(exp.values, obs.values)
+
+
+@pytest.mark.parametrize('first_year, last_year', [(2016, 2100),
+                                                   (2030, 2100)])
+def test_annual_cumulative(co2, first_year, last_year):
+    # summing the annual grid equals the closed form up to rounding
+    obs = indicators.annual(co2, first_year, last_year).sum(axis=1,
+                                                            skipna=False)
+    exp = indicators.cumulative(co2, first_year, last_year)
+    np.testing.assert_allclose(obs.values, exp.values, rtol=1e-12)
+
+
+def test_annual_cached(co2):
+    obs = indicators.annual(co2)
+    assert np.shares_memory(obs.values, indicators.annual(co2).values)
+    assert not obs.values.flags.writeable
+    assert not np.shares_memory(obs.values, indicators.annual(co2.copy()).values)
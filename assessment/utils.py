@@ -7,84 +7,168 @@ of the IPCC SR15 scenario assessment
 @author: huppmann
 """
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import pyam
+
+from profiling import stage
+
 rc = pyam.run_control()
 
+# statistics of `box_stats()` drawn by `Axes.bxp()`
+BXP_KEYS = ['q1', 'med', 'q3', 'whislo', 'whishi']
+
+
+def _lerp(a, b, t):
+    """Linear interpolation as in `numpy.percentile()`"""
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def box_stats(df, column, categories, years, ar5_format=False, ymax=None):
+    """Compute the statistics of boxplots for all (category, year) at once
+
+    The values of all categories and years are sorted in one pass (grouped by
+    category and year), and quartiles, whiskers and counts are read off
+    the sorted array. The statistics are identical to `plt.boxplot()`
+    with `whis='range'` (or `whis=0` if `ar5_format`).
+
+    Returns
+    -------
+    dict
+        arrays of shape (categories, years) with keys `count`, `q1`, `med`,
+        `q3`, `whislo`, `whishi`, `min`, `max` and `outliers`
+        (number of values above `ymax`)
+    """
+    n_cat, n_yr = len(categories), len(years)
+    codes = pd.Categorical(df[column], categories=categories).codes
+    values = np.asarray(df[years].values, dtype=float)
+
+    key = codes[:, np.newaxis] * n_yr + np.arange(n_yr)[np.newaxis, :]
+    valid = (codes[:, np.newaxis] >= 0) & ~np.isnan(values)
+    key, x = key[valid], values[valid]
+    order = np.lexsort((x, key))
+    key, x = key[order], x[order]
+
+    count = np.bincount(key, minlength=n_cat * n_yr)
+    start = np.cumsum(count) - count
+    x = np.append(x, np.nan)  # dummy element for empty groups
+
+    def element(k):
+        return x[np.where(count > 0, start + k, len(x) - 1)]
+
+    def quantile(p):
+        pos = (np.maximum(count, 1) - 1) * p
+        lo = np.floor(pos).astype(int)
+        hi = np.ceil(pos).astype(int)
+        return _lerp(element(lo), element(hi), pos - lo)
 
+    q1, med, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    first, last = element(0), element(np.maximum(count, 1) - 1)
+
+    if ar5_format:  # `whis=0`: whiskers at the quartiles
+        whislo, whishi = q1, q3
+    else:  # `whis='range'`: whiskers at the minimum and maximum
+        whislo, whishi = first, last
+
+    outliers = np.zeros(n_cat * n_yr, dtype=int) if ymax is None else \
+        np.bincount(key[x[:-1] > ymax], minlength=n_cat * n_yr)
+
+    stats = dict(count=count, q1=q1, med=med, q3=q3, whislo=whislo,
+                 whishi=whishi, min=first, max=last, outliers=outliers)
+    return {k: v.reshape(n_cat, n_yr) for k, v in stats.items()}
+
+
+def marker_args(m, zorder=3):
+    """Arguments of `plt.scatter()` for a marker scenario (from the run control)
+    """
+    return dict(zorder=zorder,
+                edgecolors=rc['edgecolors']['marker'][m],
+                c=rc['c']['marker'][m],
+                marker=rc['marker']['marker'][m],
+                linewidths=1)
+
+
+@stage('boxplot_by_cat')
 def boxplot_by_cat(df, categories, column, years, mincount=7,
                    ymax=None, ymin=None, title=None, ylabel=None, xlabel=None,
                    legend=True, log_scale=False, hlines=None,
                    add_marker=None, ar5_format=False, save=False):
 
-    groupby = df.groupby(column)
+    ax = plt.gca()
     _cats = len(categories) - 1
     w = 0.6 / _cats
-
-    if add_marker is not None:
-        def marker_args(m):
-            return dict(zorder=3,
-                        edgecolors=rc['edgecolors']['marker'][m],
-                        c=rc['c']['marker'][m],
-                        marker=rc['marker']['marker'][m],
-                        linewidths=1)
+    stats = box_stats(df, column, categories, years, ar5_format, ymax)
+    codes = pd.Categorical(df[column], categories=categories).codes
 
     for i, name in enumerate(categories):
-        if name not in groupby.groups or groupby.get_group(name).empty:
+        n = (codes == i).sum()
+        if n == 0:
             continue
 
-        _df = groupby.get_group(name)
+        _df = df[codes == i]
         c = rc['color'][column][name]
+        count = stats['count'][i]
+        pos = 0.75 / _cats * (i - _cats / 2) + np.arange(len(years))
 
-        for j, y in enumerate(years):
-            lst = _df[y][~np.isnan(_df[y])]
-            pos = (0.75 / _cats * (i - _cats / 2) + j)
+        for j in np.flatnonzero(stats['outliers'][i]):
+            plt.text(pos[j] - 0.01 * len(years),
+                     ymax * (1.15 if log_scale else 1.02),
+                     stats['outliers'][i][j])
 
-            outliers = len(lst[lst > ymax])
-            if outliers > 0:
-                plt.text(pos - 0.01 * len(years),
-                         ymax * (1.15 if log_scale else 1.02), outliers)
-
-            if len(lst) >= mincount:
-                p = plt.boxplot(lst, positions=[pos], widths=w * .90,
-                                whis=0 if ar5_format else 'range', sym='',
-                                patch_artist=True)
-                plt.tick_params(
-                    axis='x',          # changes apply to the x-axis
-                    which='both',      # both major and minor ticks are
-                    bottom=False,      # ticks along the bottom edge are off
-                    top=False,         # ticks along the top edge are off
-                    labelbottom=True if len(years) > 1 else False)
-                plt.setp(p['boxes'], color=c)
-                plt.setp(p['medians'], color='black')
+        box = count >= mincount
+        if box.any():
+            bxp = [{k: stats[k][i][j] for k in BXP_KEYS}
+                   for j in np.flatnonzero(box)]
+            p = ax.bxp(bxp, positions=pos[box], widths=w * .90,
+                       showfliers=False, patch_artist=True)
+            plt.tick_params(
+                axis='x',          # changes apply to the x-axis
+                which='both',      # both major and minor ticks are
+                bottom=False,      # ticks along the bottom edge are off
+                top=False,         # ticks along the top edge are off
+                labelbottom=True if len(years) > 1 else False)
+            plt.setp(p['boxes'], color=c)
+            plt.setp(p['medians'], color='black')
+
+        # individual values (shown for categories with few scenarios)
+        values = np.asarray(_df[years].values, dtype=float)
+        x = np.broadcast_to(pos, values.shape)
+        small = ~box & (count > 0)
+
+        if ar5_format and box.any():
+            lo, hi = stats['min'][i][box], stats['max'][i][box]
+            plt.bar(x=pos[box], height=hi - lo, bottom=lo, zorder=2, width=w,
+                    color='white', edgecolor='grey', linewidth=0.5,
+                    label=None)
+            show = ~np.isnan(values) & box
+            plt.scatter(x=x[show], y=values[show], zorder=3,
+                        c='grey', edgecolors='grey', linewidth=0.5,
+                        marker='x', s=15, label=None)
 
-                if ar5_format:
-                    lst = _df[y][~np.isnan(_df[y])]
-                    h = max(lst) - min(lst)
-                    b = min(lst)
-                    plt.bar(x=pos, height=h, bottom=b, zorder=2, width=w,
-                            color='white', edgecolor='grey', linewidth=0.5,
-                            label=None)
-                    plt.scatter(x=[pos] * len(lst), y=lst, zorder=3,
-                                c='grey', edgecolors='grey', linewidth=0.5,
-                                marker='x', s=15, label=None)
-            else:
-                plt.scatter(x=[pos] * len(lst), y=lst, zorder=6,
-                            c=c, edgecolors='black', marker='o',
-                            s=30, label=None)
-                plt.plot([pos, pos], [max(lst), min(lst)], zorder=4,
-                         color='black', linewidth=1, linestyle='-',
-                         marker='_', markersize=8, markeredgewidth=1,
-                         markeredgecolor='black')
-
-            if add_marker is not None:
-                for m in [i for i in _df.marker if isinstance(i, str)]:
-                    _df_m = _df[_df.marker == m]
-                    val = _df_m[y]
-                    plt.scatter(x=pos, y=val, **marker_args(m),
-                                s=50, label=None)
-
-        plt.plot([], c=c, label='{} [{}]'.format(name, len(_df)))
+        if small.any():
+            show = ~np.isnan(values) & small
+            plt.scatter(x=x[show], y=values[show], zorder=6,
+                        c=c, edgecolors='black', marker='o',
+                        s=30, label=None)
+            # vertical lines from minimum to maximum, separated by nan
+            k = np.flatnonzero(small)
+            plt.plot(np.repeat(pos[k], 3),
+                     np.column_stack([stats['max'][i][k], stats['min'][i][k],
+                                      np.full(len(k), np.nan)]).ravel(),
+                     zorder=4, color='black', linewidth=1, linestyle='-',
+                     marker='_', markersize=8, markeredgewidth=1,
+                     markeredgecolor='black')
+
+        if add_marker is not None:
+            markers = _df.marker[[isinstance(m, str) for m in _df.marker]]
+            for m in markers.unique():
+                val = np.asarray(_df[_df.marker == m][years].values,
+                                 dtype=float)
+                plt.scatter(x=np.broadcast_to(pos, val.shape).ravel(),
+                            y=val.ravel(), **marker_args(m), s=50, label=None)
+
+        plt.plot([], c=c, label='{} [{}]'.format(name, n))
 
     if add_marker is not None:
         for m in add_marker:
@@ -114,3 +198,301 @@ def boxplot_by_cat(df, categories, column, years, mincount=7,
 
     if save:
         plt.savefig(save)
+
+
+@stage('line_plots_with_markers')
+def line_plots_with_markers(df, panels, years, categories, add_marker,
+                            styles, shape=(2, 2)):
+    """Plot the timeseries of several variables (one panel per variable),
+    highlighting the 1.5°C pathways and the marker scenarios
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        timeseries data with the columns `category` and `marker`
+    panels : list of tuples
+        variable, name (for the axis label) and panel label
+    years : list
+        years (columns of `df`) to be plotted
+    categories : list
+        categories of the 1.5°C pathways (other scenarios are shown in grey)
+    add_marker : list
+        marker scenarios
+    styles : dict
+        line styles (arguments of `plt.plot()`) by marker scenario
+    shape : tuple, default (2, 2)
+        rows and columns of panels
+    """
+    fig = plt.gcf()
+    axes = fig.subplots(*shape)
+
+    for ax, (variable, name, label) in zip(axes.flat, panels):
+        _df = df[df.index.get_level_values('variable') == variable]
+        is_15 = _df.category.isin(categories)
+
+        ax.plot(_df.loc[~is_15, years].T, color='lightgrey')
+        ax.scatter(x=[], y=[], c='lightgrey', label='all scenarios')
+
+        ax.plot(_df.loc[is_15, years].T, color='xkcd:baby blue')
+        ax.scatter(x=[], y=[], c='xkcd:baby blue', label='1.5°C pathways')
+
+        for m in add_marker:
+            val = _df.loc[_df.marker == m, years]
+            if not val.empty:
+                ax.plot(val.T, color='xkcd:darkish blue', **styles[m],
+                        label=m)
+
+        unit = _df.index.get_level_values('unit')[0]
+        ax.set_ylabel('{} ({})'.format(name, unit))
+        pyam.plotting.set_panel_label('({})'.format(label), ax=ax)
+
+    axes.flat[0].legend(loc=1)
+    fig.tight_layout()
+
+
+@stage('boxplot_columns_by_cat')
+def boxplot_columns_by_cat(df, columns, categories, ymax, ylabel=None,
+                           add_marker=None, legend=True):
+    """Boxplots of several indicators (one group per column),
+    with one box per category
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        indicators by scenario with the columns `category` and `marker`
+    columns : list
+        columns of `df` to be plotted (also used as tick labels)
+    categories : list
+        categories (one box per category and column)
+    ymax : float
+        upper limit of the y-axis (the number of outliers is shown)
+    ylabel : str, optional
+        label of the y-axis
+    add_marker : list, optional
+        marker scenarios to be highlighted
+    legend : bool, default True
+        show the legend
+    """
+    ax = plt.gca()
+    _cats = len(categories) - 1
+    n = len(columns)
+    add_marker = add_marker or []
+    stats = box_stats(df, 'category', categories, columns, ymax=ymax)
+
+    for i, name in enumerate(columns):
+        for j, c in enumerate(categories):
+            _df = df[df.category == c]
+            pos = 0.5 / _cats * (j - _cats / 2) + i
+
+            outliers = stats['outliers'][j][i]
+            if outliers > 0:
+                plt.text(pos - 0.01 * len(categories), ymax * 1.01, outliers)
+
+            if stats['count'][j][i] > 0:
+                bxp = {k: stats[k][j][i] for k in BXP_KEYS}
+                p = ax.bxp([bxp], positions=[pos], widths=(0.3 / _cats),
+                           showfliers=False, patch_artist=True)
+                plt.setp(p['boxes'], color=rc['color']['category'][c])
+                plt.setp(p['medians'], color='black')
+
+            for m in add_marker:
+                val = _df.loc[_df.marker == m, name]
+                if not val.empty:
+                    plt.scatter(x=pos, y=val, **marker_args(m, zorder=4),
+                                s=40, label=None)
+
+    for m in add_marker:
+        if (df.marker == m).any():
+            plt.scatter(x=[], y=[], **marker_args(m, zorder=4), s=60, label=m)
+
+    for c in categories:
+        plt.plot([], c=rc['color']['category'][c], label='{}'.format(c))
+
+    if legend:
+        plt.legend()
+
+    plt.grid(False)
+    plt.xlim(-0.6, (n - 0.4))
+    plt.xticks(range(0, n), columns)
+    plt.vlines(x=[_i + 0.5 for _i in range(n - 1)], ymin=0, ymax=ymax,
+               colors='white')
+    plt.ylim(0, ymax)
+    if ylabel is not None:
+        plt.ylabel(ylabel)
+
+
+@stage('stacked_bar_by_marker')
+def stacked_bar_by_marker(df, variables, years, add_marker, ymax, ylabel=None,
+                          hist=None, hist_label=None, hist_args=None,
+                          xmin=-0.6):
+    """Stacked bars of several variables by marker scenario and year
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        timeseries data of the marker scenarios with the column `marker`
+    variables : list
+        variables to be stacked (colors from the run control, `marker`)
+    years : list
+        years (columns of `df`) to be plotted, if reported
+    add_marker : list
+        marker scenarios (one group of bars each)
+    ymax : float
+        upper limit of the y-axis
+    ylabel : str, optional
+        label of the y-axis
+    hist : list, optional
+        historical value(s) shown as horizontal line for each marker scenario
+    hist_label : str, optional
+        legend entry of the historical value(s)
+    hist_args : dict, optional
+        arguments of `plt.hlines()` for the historical value(s)
+    xmin : float, default -0.6
+        lower limit of the x-axis
+    """
+    _years = len(years) - 1
+    hist_args = hist_args or {}
+    label_list = []
+    w = 0.5 / len(years)
+
+    for i, m in enumerate(add_marker):
+        # not all scenarios extend until 2100
+        _df = df.loc[df.marker == m, years].dropna(axis=1, how='all')
+        meta = _df.index[0][0:2]
+        _label = '{}\n{}\n({})'.format(meta[0], meta[1], m)
+        _df.index = _df.index.droplevel([0, 1, 2, 4])
+
+        pos = [0.5 / _years * (j - (len(_df.columns) - 1) / 2) + i
+               for j in range(len(_df.columns))]
+        b = [0] * len(_df.columns)
+
+        for v in variables:
+            if v in _df.index:
+                lst = _df.loc[v]
+                plt.bar(x=pos, height=lst, bottom=b, width=w,
+                        color=rc['color']['marker'][v],
+                        edgecolor='black', label=None)
+                b += _df.loc[v]
+
+        if hist is not None:
+            plt.hlines(y=hist, xmin=(-.4 + i), xmax=(.4 + i), **hist_args,
+                       label=None)
+
+        label_list.append(_label)
+
+        # add years at the top
+        for j, yr in enumerate(_df.columns):
+            plt.text(pos[j] - 0.1, ymax * 1.05, yr)
+
+    # add legend entries
+    if hist is not None:
+        plt.hlines(y=[], xmin=[], xmax=[], **hist_args, label=hist_label)
+    for v in variables:
+        plt.scatter(x=[], y=[], color=rc['color']['marker'][v], label=v)
+
+    plt.legend()
+    plt.grid(False)
+    plt.xlim(xmin, (i + 0.6))
+    plt.xticks(range(0, i + 1), label_list)
+    plt.vlines(x=[_i + 0.5 for _i in range(i)], ymin=0, ymax=ymax,
+               colors='white')
+    plt.ylim(0, ymax)
+    if ylabel is not None:
+        plt.ylabel(ylabel)
+
+
+@stage('boxplot_by_variable')
+def boxplot_by_variable(df, variables, years, categories, add_marker, ymax,
+                        ylabel=None, hist=None, hist_label=None,
+                        hist_args=None, legend=False):
+    """Boxplots of several variables (one group per variable),
+    with one box per year, highlighting the marker scenarios
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        timeseries data with the columns `category` and `marker`
+    variables : list
+        variables to be plotted (colors from the run control, `marker`)
+    years : list
+        years (columns of `df`), one box per variable and year
+    categories : list
+        categories of the scenarios included in the boxes
+    add_marker : list
+        marker scenarios (of any category) to be highlighted
+    ymax : float
+        upper limit of the y-axis (the number of outliers is shown)
+    ylabel : str, optional
+        label of the y-axis
+    hist : dict, optional
+        historical value(s) by variable, shown as horizontal lines
+    hist_label : str, optional
+        legend entry of the historical values
+    hist_args : dict, optional
+        arguments of `plt.hlines()` for the historical values
+    legend : bool, default False
+        show the legend
+    """
+    ax = plt.gca()
+    _years = len(years) - 1
+    hist_args = hist_args or {}
+    n = len(variables)
+
+    # statistics of the boxes of all variables and years in one pass
+    _df = df[df.category.isin(categories)]
+    _df = _df.assign(variable=_df.index.get_level_values('variable'))
+    stats = box_stats(_df, 'variable', variables, years, ymax=ymax)
+
+    for i, v in enumerate(variables):
+        _df = df[df.index.get_level_values('variable') == v]
+
+        for j, y in enumerate(years):
+            pos = 0.5 / _years * (j - _years / 2) + i
+
+            outliers = stats['outliers'][i][j]
+            if outliers > 0:
+                plt.text(pos - 0.01 * len(years), ymax * 1.01, outliers)
+
+            if stats['count'][i][j] > 0:
+                # width as the default of `plt.boxplot()` for a single box
+                bxp = {k: stats[k][i][j] for k in BXP_KEYS}
+                p = ax.bxp([bxp], positions=[pos], widths=0.15,
+                           showfliers=False, patch_artist=True)
+                plt.setp(p['boxes'], color=rc['color']['marker'][v])
+                plt.setp(p['medians'], color='black')
+
+            for m in add_marker:
+                val = _df.loc[_df.marker == m, y]
+                if not val.empty:
+                    plt.scatter(x=pos, y=val, **marker_args(m, zorder=4),
+                                s=40, label=None)
+
+        if hist is not None and v in hist:
+            plt.hlines(y=hist[v], xmin=(-.4 + i), xmax=(.4 + i), **hist_args,
+                       label=None)
+
+    # add legend entries
+    if hist is not None:
+        plt.hlines(y=[], xmin=[], xmax=[], **hist_args, label=hist_label)
+    for m in add_marker:
+        meta = df[df.marker == m].index[0][0:2]
+        _label = '{}|{} ({})'.format(meta[0], meta[1], m)
+        plt.scatter(x=[], y=[], **marker_args(m, zorder=4), s=60,
+                    label=_label)
+
+    # add years at the top
+    for _i in range(0, n):
+        for j, yr in enumerate(years):
+            plt.text(0.5 / _years * (j - _years / 2) + _i - 0.1,
+                     ymax * 1.05, yr)
+
+    if legend:
+        plt.legend()
+    plt.grid(False)
+    plt.xlim(-0.6, (n - 0.4))
+    plt.xticks(range(0, n), variables)
+    plt.vlines(x=[_i + 0.5 for _i in range(n - 1)], ymin=0, ymax=ymax,
+               colors='white')
+    plt.ylim(0, ymax)
+    if ylabel is not None:
+        plt.ylabel(ylabel)